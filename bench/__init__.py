@@ -0,0 +1 @@
+"""Offline benchmark harness: python -m bench.run --help"""
@@ -0,0 +1,306 @@
+"""Offline load test and benchmark for the bot.
+
+    python -m bench.run --sizes 1000,10000,100000,1000000
+
+For every catalog size a synthetic catalog is imported with
+`python main.py import` (and kept in --data-dir for later runs). A worker
+process then builds the real Application with main.build_application(),
+pointed at a local stub Bot API server, with OMDB replaced by a local stub
+too, and replays /search conversations, /random and admin commands from
+concurrent virtual users as synthetic Updates. Throughput and p50/p95/p99
+latency per step are reported for each size.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from telegram import Update
+
+from bench.stubs import OMDBStub, TelegramStub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOKEN = '123456:bench'
+
+WORDS = (
+    'dark night river city storm shadow king queen love war peace star moon sun '
+    'ghost road home heart blood fire ice stone gold silver iron glass dream '
+    'secret last first lost hidden wild silent broken golden endless final '
+    'empire kingdom island ocean mountain desert forest garden winter summer '
+    'spring autumn journey return rise fall legend story game hunter killer '
+    'doctor soldier stranger brother sister father mother son daughter friend '
+    'enemy angel devil hero house street bridge tower castle prison school '
+    'train ship machine planet galaxy world time memory promise revenge escape'
+).split()
+
+GENRES = ('Drama', 'Comedy', 'Action', 'Thriller', 'Horror', 'Romance', 'Sci-Fi', 'Animation', 'Crime', 'Fantasy')
+
+# Words OMDB (the stub) knows but the local catalog doesn't
+OMDB_ONLY_WORDS = ('zephyr', 'quasar', 'nebulon', 'paragon', 'vortexa')
+
+# Every tenth virtual user is an admin
+ADMIN_EVERY = 10
+
+
+# Catalog seeding (parent process)
+
+def catalog_records(size):
+    rng = random.Random(size)
+    for n in range(size):
+        title = ' '.join(rng.sample(WORDS, rng.randint(1, 3))).title()
+        yield {
+            'title': f"{title} {n}" if rng.random() < 0.3 else title,
+            'year': rng.randint(1950, 2024),
+            'genre': ', '.join(rng.sample(GENRES, rng.randint(1, 2))),
+            'rating': round(rng.uniform(1, 9.5), 1),
+            'description': f"A synthetic movie about {' and '.join(rng.sample(WORDS, 3))}.",
+            'poster_url': f"https://posters.example/{n}.jpg" if rng.random() < 0.5 else '',
+            'imdb_id': f"tt9{n:07d}",
+        }
+
+
+def ensure_catalog(data_dir, size):
+    """Return the path of a seeded catalog, importing it on first use."""
+    path = os.path.join(data_dir, f"catalog-{size}.db")
+    if os.path.exists(path):
+        return path
+    os.makedirs(data_dir, exist_ok=True)
+    print(f"Seeding a catalog of {size:,} movies...", file=sys.stderr)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'catalog.jsonl')
+        with open(source, 'w', encoding='utf-8') as f:
+            for record in catalog_records(size):
+                f.write(json.dumps(record) + '\n')
+        seeded = os.path.join(tmp, 'catalog.db')
+        env = {**os.environ, 'DB_PATH': seeded}
+        subprocess.run([sys.executable, 'main.py', 'import', source, '--format', 'jsonl'],
+                       env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        shutil.move(seeded, path)
+    return path
+
+
+async def run_size(args, size, telegram, omdb_stub):
+    catalog = ensure_catalog(args.data_dir, size)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'movies.db')
+        shutil.copy(catalog, database)
+        env = {
+            **os.environ,
+            'DB_PATH': database,
+            'OMDB_URL': f"http://127.0.0.1:{omdb_stub.port}/",
+            'OMDB_API_KEY': 'bench',
+            'METRICS_PORT': '0',
+            # Measure the bot, not Telegram's flood limits
+            'SEND_GLOBAL_RATE': '1000000', 'SEND_GLOBAL_BURST': '1000000',
+            'SEND_CHAT_RATE': '1000000', 'SEND_CHAT_BURST': '1000000',
+        }
+        command = [
+            sys.executable, '-m', 'bench.run', '--worker',
+            '--telegram-url', f"http://127.0.0.1:{telegram.port}/bot",
+            '--size', str(size), '--users', str(args.users), '--iterations', str(args.iterations),
+            '--listmovies-max', str(args.listmovies_max),
+        ]
+        process = await asyncio.create_subprocess_exec(*command, env=env, cwd=ROOT, stdout=asyncio.subprocess.PIPE)
+        output, _ = await process.communicate()
+        if process.returncode:
+            raise RuntimeError(f"Benchmark worker for {size} movies exited with {process.returncode}")
+        return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def print_report(result):
+    print(f"\n{result['size']:,} movies: {result['updates']} updates in {result['seconds']:.1f}s "
+          f"({result['throughput']:.1f} updates/s), indexes built in {result['index_seconds']:.1f}s")
+    print(f"  {'step':<20} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, summary in sorted(result['latency'].items()):
+        print(f"  {label:<20} {summary['count']:>6} {summary['p50']:>9.1f} {summary['p95']:>9.1f} {summary['p99']:>9.1f}")
+
+
+async def run(args):
+    telegram = await TelegramStub(args.telegram_latency).start()
+    omdb_stub = await OMDBStub(args.omdb_latency).start()
+    results = []
+    try:
+        for size in args.sizes:
+            result = await run_size(args, size, telegram, omdb_stub)
+            print_report(result)
+            results.append(result)
+    finally:
+        telegram.close()
+        omdb_stub.close()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+# Load generation (worker process)
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+
+    def add(self, label, seconds):
+        self.latencies.setdefault(label, []).append(seconds * 1000)
+
+    def summary(self):
+        result = {}
+        for label, values in self.latencies.items():
+            values.sort()
+            result[label] = {'count': len(values), 'p50': percentile(values, 0.5),
+                             'p95': percentile(values, 0.95), 'p99': percentile(values, 0.99)}
+        return result
+
+
+class VirtualUser:
+    def __init__(self, application, recorder, user_id, rng):
+        self.application = application
+        self.recorder = recorder
+        self.user_id = user_id
+        self.rng = rng
+
+    def _message(self, update_id, text):
+        message = {
+            'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': self.user_id, 'type': 'private'},
+            'from': {'id': self.user_id, 'is_bot': False, 'first_name': 'Bench'},
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': update_id, 'message': message}, self.application.bot)
+
+    def _callback(self, update_id, data):
+        user = {'id': self.user_id, 'is_bot': False, 'first_name': 'Bench'}
+        message = {'message_id': update_id, 'date': int(time.time()), 'text': 'Results',
+                   'chat': {'id': self.user_id, 'type': 'private'}}
+        query = {'id': str(update_id), 'from': user, 'chat_instance': str(self.user_id),
+                 'data': data, 'message': message}
+        return Update.de_json({'update_id': update_id, 'callback_query': query}, self.application.bot)
+
+    async def send(self, label, text=None, callback_data=None):
+        update_id = next(UPDATE_IDS)
+        if callback_data is None:
+            update = self._message(update_id, text)
+        else:
+            update = self._callback(update_id, callback_data)
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        self.recorder.add(label, time.perf_counter() - started)
+
+    def search_title(self):
+        roll = self.rng.random()
+        if roll < 0.8:
+            return ' '.join(self.rng.sample(WORDS, self.rng.randint(1, 2)))
+        if roll < 0.9:
+            return self.rng.choice(OMDB_ONLY_WORDS)
+        # A typo: misses locally and on OMDB, falls through to suggestions
+        return 'zz' + self.rng.choice(WORDS)
+
+    async def search(self):
+        await self.send('search:start', '/search')
+        await self.send('search:title', self.search_title())
+        for _ in range(4):
+            await self.send('search:skip', '/skip')
+        await self.send('search:run', '/skip')
+        state = self.application.user_data[self.user_id].get('search')
+        if state and len(state['cursors']) > 1:
+            await self.send('search:next', callback_data=f"page:{state['id']}:1")
+
+    async def random(self):
+        await self.send('random', '/random')
+        await self.send('random:filtered', f"/random {self.rng.choice(GENRES).lower()} 7")
+
+    async def admin(self, main, iteration):
+        title = f"Bench Movie {self.user_id}-{iteration}"
+        await self.send('admin', '/admin')
+        await self.send('admin:addmovie', '/addmovie')
+        await self.send('admin:add', f"Title: {title}\nYear: 2020\nGenre: Drama\nRating: 7.5\n"
+                                     f"Description: Added by the benchmark.\nActors: Jane Doe\nDirector: Sam Poe")
+        row = await main.db.fetchone("SELECT id FROM movies WHERE title=?", (title,))
+        if row:
+            await self.send('admin:delmovie', f"/delmovie {row[0]}")
+
+    async def run(self, main, iterations):
+        for iteration in range(iterations):
+            await self.search()
+            await self.random()
+            if self.user_id % ADMIN_EVERY == 0:
+                await self.admin(main, iteration)
+
+
+UPDATE_IDS = itertools.count(1)
+
+
+async def worker(args):
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+
+    main.init_db()
+    user_ids = [10000 + n for n in range(args.users)]
+    for user_id in user_ids:
+        if user_id % ADMIN_EVERY == 0:
+            main.add_admin(user_id)
+
+    application = main.build_application(TOKEN, base_url=args.telegram_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    started = time.perf_counter()
+    await asyncio.gather(*application.bot_data['index_tasks'])
+    index_seconds = time.perf_counter() - started
+
+    recorder = Recorder()
+    users = [VirtualUser(application, recorder, user_id, random.Random(user_id)) for user_id in user_ids]
+    started = time.perf_counter()
+    await asyncio.gather(*(user.run(main, args.iterations) for user in users))
+    if args.size <= args.listmovies_max:
+        admin_user = next((user for user in users if user.user_id % ADMIN_EVERY == 0), None)
+        if admin_user:
+            await admin_user.send('admin:listmovies', '/listmovies')
+    seconds = time.perf_counter() - started
+
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+    latency = recorder.summary()
+    updates = sum(summary['count'] for summary in latency.values())
+    print(json.dumps({'size': args.size, 'updates': updates, 'seconds': seconds,
+                      'throughput': updates / seconds, 'index_seconds': index_seconds, 'latency': latency}))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m bench.run', description='Offline load test for the bot.')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        type=lambda value: [int(size) for size in value.split(',')],
+                        help='comma-separated catalog sizes')
+    parser.add_argument('--users', type=int, default=20, help='concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=5, help='scenario rounds per user')
+    parser.add_argument('--telegram-latency', type=float, default=0.01, help='stub Bot API delay in seconds')
+    parser.add_argument('--omdb-latency', type=float, default=0.1, help='stub OMDB delay in seconds')
+    parser.add_argument('--listmovies-max', type=int, default=100000,
+                        help='skip /listmovies for catalogs larger than this')
+    parser.add_argument('--data-dir', default=os.path.join(ROOT, 'bench', 'data'), help='where seeded catalogs are kept')
+    parser.add_argument('--json', help='also write the results to this file')
+    # Internal: run one catalog size in a worker process
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--telegram-url', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_args(sys.argv[1:])
+    asyncio.run(worker(arguments) if arguments.worker else run(arguments))
@@ -0,0 +1,132 @@
+"""Local stand-ins for the Telegram Bot API and OMDB used by the benchmark.
+
+Both are tiny keep-alive HTTP/1.1 servers on asyncio that answer every
+request after a configurable delay, so the bot can be load-tested offline.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubServer:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.server = None
+        self.port = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                url = urlsplit(target)
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                if headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+                    params.update({name: values[-1] for name, values in parse_qs(body.decode()).items()})
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                payload = json.dumps(self.respond(method, url.path, params)).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, method, path, params):
+        raise NotImplementedError
+
+
+class TelegramStub(StubServer):
+    """Accepts any Bot API call and returns a plausible result. Point the bot
+    at it with base_url=f"http://127.0.0.1:{port}/bot"."""
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.calls = {}
+        self._message_id = 0
+
+    def _message(self, params, **extra):
+        self._message_id += 1
+        chat_id = int(params.get('chat_id', 1))
+        return {'message_id': self._message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, **extra}
+
+    def _photo(self, source):
+        digest = hashlib.md5(str(source).encode()).hexdigest()
+        return [{'file_id': f"file-{digest}", 'file_unique_id': digest[:16], 'width': 300, 'height': 450}]
+
+    def respond(self, method, path, params):
+        api_method = path.rsplit('/', 1)[-1].lower()
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if api_method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+                      'can_join_groups': True, 'can_read_all_group_messages': False,
+                      'supports_inline_queries': True}
+        elif api_method in ('sendmessage', 'editmessagetext', 'editmessagereplymarkup'):
+            result = self._message(params, text=params.get('text', ''))
+        elif api_method == 'sendphoto':
+            result = self._message(params, photo=self._photo(params.get('photo')))
+        elif api_method == 'sendmediagroup':
+            media = json.loads(params.get('media', '[]'))
+            result = [self._message(params, photo=self._photo(item.get('media'))) for item in media]
+        else:
+            result = True
+        return {'ok': True, 'result': result}
+
+
+class OMDBStub(StubServer):
+    """Answers OMDB search (s=) and detail (i=) queries with synthetic movies.
+    Queries starting with "zz" find nothing, like typos would."""
+
+    def respond(self, method, path, params):
+        if 'i' in params:
+            return self._details(params['i'])
+        query = params.get('s') or params.get('t') or ''
+        if not query or query.lower().startswith('zz'):
+            return {'Response': 'False', 'Error': 'Movie not found!'}
+        if 't' in params:
+            return self._details(self._imdb_id(query, 0))
+        results = [{'Title': f"{query.title()} {n}", 'Year': str(1990 + n), 'imdbID': self._imdb_id(query, n),
+                    'Type': 'movie', 'Poster': f"https://posters.example/{self._imdb_id(query, n)}.jpg"}
+                   for n in range(3)]
+        return {'Search': results, 'totalResults': str(len(results)), 'Response': 'True'}
+
+    @staticmethod
+    def _imdb_id(query, n):
+        return 'tt' + str(int(hashlib.md5(f"{query}:{n}".encode()).hexdigest()[:7], 16)).zfill(8)
+
+    @staticmethod
+    def _details(imdb_id):
+        return {'Title': f"Movie {imdb_id}", 'Year': '2001', 'Genre': 'Drama, Thriller', 'imdbRating': '7.1',
+                'Plot': 'A synthetic plot.', 'Poster': f"https://posters.example/{imdb_id}.jpg",
+                'Actors': 'Jane Doe, John Roe', 'Director': 'Sam Poe', 'imdbID': imdb_id,
+                'Type': 'movie', 'Response': 'True'}
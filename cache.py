@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from db import db
+
+logger = logging.getLogger(__name__)
+
+# Cache tuning (TTLs in seconds)
+OMDB_CACHE_SIZE = int(os.environ.get('OMDB_CACHE_SIZE', 2048))
+OMDB_SEARCH_TTL = int(os.environ.get('OMDB_SEARCH_TTL', 6 * 3600))
+OMDB_DETAIL_TTL = int(os.environ.get('OMDB_DETAIL_TTL', 7 * 24 * 3600))
+OMDB_NEGATIVE_TTL = int(os.environ.get('OMDB_NEGATIVE_TTL', 600))
+
+# Expired responses are kept this long to answer from while OMDB is down
+OMDB_STALE_TTL = int(os.environ.get('OMDB_STALE_TTL', 7 * 24 * 3600))
+
+# OMDB errors that describe the query rather than the service, so they are
+# safe to cache for a short while
+NEGATIVE_ERRORS = {'Movie not found!', 'Incorrect IMDb ID.'}
+
+# Purge expired rows from the SQLite tier every this many writes
+PURGE_EVERY = 500
+
+
+class LRUCache:
+    """In-process LRU cache whose entries carry their own expiry time."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, now=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= (now or time.time()):
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, expires_at):
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class OMDBCache:
+    """Two-tier cache for OMDB responses: an in-process LRU backed by the
+    `omdb_cache` table in movies.db so entries survive restarts."""
+
+    def __init__(self, database=db, maxsize=OMDB_CACHE_SIZE):
+        self.db = database
+        self.memory = LRUCache(maxsize)
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'negative_hits': 0}
+        self._writes = 0
+
+    def _disk_set(self, conn, key, response, expires_at):
+        conn.execute(
+            "INSERT OR REPLACE INTO omdb_cache (key, response, expires_at) VALUES (?, ?, ?)",
+            (key, response, expires_at)
+        )
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM omdb_cache WHERE expires_at <= ?", (time.time() - OMDB_STALE_TTL,))
+
+    async def get(self, params):
+        key = cache_key(params)
+        now = time.time()
+
+        data = self.memory.get(key, now)
+        if data is not None:
+            self.stats['memory_hits'] += 1
+        else:
+            try:
+                row = await self.db.fetchone(
+                    "SELECT response, expires_at FROM omdb_cache WHERE key=? AND expires_at > ?", (key, now)
+                )
+            except sqlite3.Error as e:
+                logger.error(f"OMDB cache read failed: {e}")
+                row = None
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            data = json.loads(row[0])
+            self.memory.set(key, data, row[1])
+            self.stats['disk_hits'] += 1
+
+        if data.get('Response') == 'False':
+            self.stats['negative_hits'] += 1
+        return data
+
+    async def set(self, params, data):
+        ttl = response_ttl(params, data)
+        if not ttl:
+            return
+        key = cache_key(params)
+        expires_at = time.time() + ttl
+        self.memory.set(key, data, expires_at)
+        try:
+            await self.db.write(self._disk_set, key, json.dumps(data), expires_at)
+        except sqlite3.Error as e:
+            logger.error(f"OMDB cache write failed: {e}")
+
+    async def get_stale(self, params):
+        """Return the stored response for a query even if it has expired."""
+        try:
+            row = await self.db.fetchone("SELECT response FROM omdb_cache WHERE key=?", (cache_key(params),))
+        except sqlite3.Error as e:
+            logger.error(f"OMDB cache read failed: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def hit_rate(self):
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+
+# Normalized cache key for an OMDB query (the API key is never part of it)
+def cache_key(params):
+    items = []
+    for name, value in sorted(params.items()):
+        if name == 'apikey' or value is None:
+            continue
+        value = str(value).strip()
+        if name == 's':
+            value = ' '.join(value.lower().split())
+        items.append(f"{name}={value}")
+    return '&'.join(items)
+
+
+# How long a response may be cached, or 0 if it must not be cached
+def response_ttl(params, data):
+    if data.get('Response') == 'True':
+        if 'i' in params:
+            return OMDB_DETAIL_TTL
+        if 's' in params:
+            return OMDB_SEARCH_TTL
+        return 0
+    if data.get('Error') in NEGATIVE_ERRORS:
+        return OMDB_NEGATIVE_TTL
+    return 0
+
+
+omdb_cache = OMDBCache()
@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+import sqlite3
+import time
+
+import omdb
+from db import db
+from gateway import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# OMDB-sourced rows older than this (in seconds) are refreshed in the background
+OMDB_REFRESH_AGE = int(os.environ.get('OMDB_REFRESH_AGE', 7 * 24 * 3600))
+
+# Minimum delay between two refresh attempts of the same title
+REFRESH_RETRY_DELAY = 3600
+
+# imdbID -> time of the last background refresh attempt
+_refresh_attempts = {}
+
+# Release years accepted from users (/search, /addmovie)
+MIN_YEAR, MAX_YEAR = 1800, 2100
+
+
+# OMDB uses the string 'N/A' for missing values
+def omdb_value(value):
+    if value is None or value == 'N/A':
+        return None
+    return value
+
+
+# First four-digit year of an OMDB year ("2010", "2008–2013")
+def parse_year(value):
+    match = re.match(r'\d{4}', omdb_value(value) or '')
+    return int(match.group()) if match else None
+
+
+def parse_rating(value):
+    try:
+        return float(omdb_value(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# Upsert the rows of an OMDB search response. Search results only carry
+# title, year and poster, so existing details are left untouched; rows
+# without details are picked up by refresh_stale().
+def upsert_search_results(conn, results, fetched_at):
+    conn.executemany("""
+        INSERT INTO movies (title, year, poster_url, imdb_id, source, fetched_at)
+        VALUES (?, ?, ?, ?, 'omdb', ?)
+        ON CONFLICT (imdb_id) DO UPDATE SET
+            title = excluded.title,
+            year = excluded.year,
+            poster_url = excluded.poster_url
+        WHERE movies.source = 'omdb'
+    """, [
+        (movie['Title'], parse_year(movie.get('Year')), omdb_value(movie.get('Poster')) or '',
+         movie['imdbID'], fetched_at)
+        for movie in results
+        if movie.get('imdbID') and movie.get('Title')
+    ])
+
+
+# Upsert a full OMDB detail response, including its cast and crew
+def upsert_details(conn, details, fetched_at):
+    conn.execute("""
+        INSERT INTO movies (title, year, genre, rating, description, poster_url, imdb_id, source, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 'omdb', ?)
+        ON CONFLICT (imdb_id) DO UPDATE SET
+            title = excluded.title,
+            year = excluded.year,
+            genre = excluded.genre,
+            rating = excluded.rating,
+            description = excluded.description,
+            poster_url = excluded.poster_url,
+            fetched_at = excluded.fetched_at
+        WHERE movies.source = 'omdb'
+    """, (
+        details['Title'],
+        parse_year(details.get('Year')),
+        omdb_value(details.get('Genre')),
+        parse_rating(details.get('imdbRating')),
+        omdb_value(details.get('Plot')),
+        omdb_value(details.get('Poster')) or '',
+        details['imdbID'],
+        fetched_at,
+    ))
+    row = conn.execute(
+        "SELECT id FROM movies WHERE imdb_id = ? AND source = 'omdb'", (details['imdbID'],)
+    ).fetchone()
+    if row:
+        link_people(conn, row[0], 'actor', split_names(details.get('Actors')))
+        link_people(conn, row[0], 'director', split_names(details.get('Director')))
+
+
+# Split an OMDB-style "Name One, Name Two" list
+def split_names(value):
+    return [name.strip() for name in (omdb_value(value) or '').split(',') if name.strip()]
+
+
+# Replace the people linked to a movie for one role ('actor' or 'director')
+def link_people(conn, movie_id, role, names):
+    conn.execute("DELETE FROM movie_people WHERE movie_id = ? AND role = ?", (movie_id, role))
+    for name in names:
+        name_norm = ' '.join(name.lower().split())
+        conn.execute(
+            "INSERT INTO people (name, name_norm) VALUES (?, ?) ON CONFLICT (name_norm) DO NOTHING",
+            (name, name_norm)
+        )
+        conn.execute("""
+            INSERT OR IGNORE INTO movie_people (person_id, role, movie_id)
+            SELECT id, ?, ? FROM people WHERE name_norm = ?
+        """, (role, movie_id, name_norm))
+
+
+async def ingest(params, data):
+    """Write a fresh, successful OMDB response through to the movies table."""
+    try:
+        if 'i' in params and data.get('imdbID') and data.get('Title'):
+            await db.write(upsert_details, data, time.time())
+        elif 's' in params and data.get('Search'):
+            await db.write(upsert_search_results, data['Search'], time.time())
+    except sqlite3.Error as e:
+        logger.error(f"Error saving OMDB response to the catalog: {e}")
+
+
+async def local_details(imdb_id):
+    """The catalog's copy of a movie, shaped like an OMDB detail response."""
+    row = await db.fetchone(
+        "SELECT title, year, genre, rating, description, poster_url FROM movies WHERE imdb_id = ?", (imdb_id,)
+    )
+    if row is None:
+        return None
+    title, year, genre, rating, description, poster_url = row
+    return {
+        'Title': title,
+        'Year': str(year) if year else 'N/A',
+        'Genre': genre or 'N/A',
+        'imdbRating': str(rating) if rating else 'N/A',
+        'Plot': description or 'N/A',
+        'Poster': poster_url or 'N/A',
+        'imdbID': imdb_id,
+        'Response': 'True',
+    }
+
+
+async def refresh_stale(movie_ids):
+    """Re-fetch OMDB details for the given movies if they are missing or old.
+
+    Meant to run as a background task after results have been sent.
+    """
+    # Refreshes are optional; don't spend effort while OMDB is unavailable
+    if not movie_ids or omdb.gateway.unavailable():
+        return
+    placeholders = ', '.join('?' * len(movie_ids))
+    rows = await db.fetchall(
+        f"SELECT imdb_id FROM movies WHERE id IN ({placeholders}) "
+        "AND source = 'omdb' AND imdb_id IS NOT NULL "
+        "AND (description IS NULL OR fetched_at < ?)",
+        [*movie_ids, time.time() - OMDB_REFRESH_AGE]
+    )
+
+    now = time.time()
+    for (imdb_id,) in rows:
+        if now - _refresh_attempts.get(imdb_id, 0) < REFRESH_RETRY_DELAY:
+            continue
+        _refresh_attempts[imdb_id] = now
+        await omdb.request({'i': imdb_id, 'plot': 'short'}, refresh=True, priority=BACKGROUND)
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.environ.get('DB_PATH', 'movies.db')
+
+# Number of reader connections (and reader threads)
+DB_READERS = int(os.environ.get('DB_READERS', 4))
+
+# Compiled statements cached per connection; long-lived connections mean
+# repeated queries skip the SQL parser entirely
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', 256))
+
+# Applied to every connection. WAL lets readers run alongside the writer.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+)
+
+# Labelled by the function run on the connection; ad-hoc SQL from fetchone,
+# fetchall and execute shows up under those names
+QUERY_SECONDS = Histogram('bot_db_query_duration_seconds', 'Time spent running SQLite work in the DB threads.',
+                          ['kind', 'operation'])
+
+
+class Database:
+    """Long-lived SQLite connections served from worker threads.
+
+    All writes go through a single writer thread and connection, so they are
+    serialized without lock contention. Reads are spread over a pool of
+    threads, each with its own read-only connection. Handlers await the
+    coroutine methods and never block the event loop on SQLite.
+    """
+
+    def __init__(self, path=DB_PATH, readers=DB_READERS):
+        self.path = path
+        self._writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._reader_pool = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        self._local = threading.local()
+        self._writer = None
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _open(self, readonly=False):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._open(readonly=True)
+        return conn
+
+    def _writer_conn(self):
+        if self._writer is None:
+            self._writer = self._open()
+        return self._writer
+
+    def _run_read(self, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(self._reader(), *args)
+        finally:
+            QUERY_SECONDS.labels(kind='read', operation=fn.__name__.lstrip('_')).observe(time.perf_counter() - started)
+
+    def _run_write(self, fn, args):
+        conn = self._writer_conn()
+        started = time.perf_counter()
+        try:
+            with conn:
+                return fn(conn, *args)
+        finally:
+            QUERY_SECONDS.labels(kind='write', operation=fn.__name__.lstrip('_')).observe(time.perf_counter() - started)
+
+    async def read(self, fn, *args):
+        """Run fn(conn, *args) on a reader connection."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader_pool, self._run_read, fn, args)
+
+    async def write(self, fn, *args):
+        """Run fn(conn, *args) in a single transaction on the writer connection."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer_pool, self._run_write, fn, args)
+
+    def write_sync(self, fn, *args):
+        """Blocking variant of write() for startup code and CLI tools."""
+        return self._writer_pool.submit(self._run_write, fn, args).result()
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(_fetchone, sql, params)
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(_fetchall, sql, params)
+
+    async def execute(self, sql, params=()):
+        """Execute a write statement and return its cursor."""
+        return await self.write(_execute, sql, params)
+
+    def close(self):
+        self._writer_pool.shutdown(wait=True)
+        self._reader_pool.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._writer = None
+        self._local = threading.local()
+
+
+def _fetchone(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
+
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+
+def _execute(conn, sql, params):
+    return conn.execute(sql, params)
+
+
+db = Database()
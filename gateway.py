@@ -0,0 +1,206 @@
+"""Admission control for OMDB calls.
+
+Every upstream request passes through an OMDBGateway, which
+- spends from a daily quota kept as a token bucket, holding back a reserve
+  for interactive searches so background refreshes cannot use it up,
+- hands out connection slots to interactive requests before background ones,
+- gives each call an overall deadline, and
+- opens a circuit breaker after consecutive failures, rejecting calls until
+  a cooldown has passed and a trial call succeeds.
+Rejected or failed calls return None; omdb.py then serves stale data.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# OMDB's free plan allows 1,000 requests per day; the supervisor gives each
+# worker process an equal share
+OMDB_DAILY_QUOTA = int(os.environ.get('OMDB_DAILY_QUOTA', 1000))
+
+# Share of the quota only interactive requests may use
+OMDB_BACKGROUND_RESERVE = float(os.environ.get('OMDB_BACKGROUND_RESERVE', 0.2))
+
+# Upper bound on one call including retries, in seconds
+OMDB_DEADLINE = float(os.environ.get('OMDB_DEADLINE', 10))
+
+# Consecutive failures that open the breaker, and seconds it stays open
+OMDB_BREAKER_THRESHOLD = int(os.environ.get('OMDB_BREAKER_THRESHOLD', 5))
+OMDB_BREAKER_COOLDOWN = float(os.environ.get('OMDB_BREAKER_COOLDOWN', 60))
+
+# Request priorities (lower is served first)
+INTERACTIVE, BACKGROUND = 0, 1
+
+# OMDB errors that mean the API key is out of requests
+QUOTA_ERRORS = {'Request limit reached!'}
+
+
+class QuotaBucket:
+    """Token bucket holding a day's worth of requests, refilled continuously."""
+
+    def __init__(self, quota=OMDB_DAILY_QUOTA, period=86400):
+        self.capacity = quota
+        self.rate = quota / period
+        self.tokens = float(quota)
+        self.updated = time.monotonic()
+
+    def available(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, reserve=0.0):
+        """Spend a token if more than `reserve` tokens would be left over."""
+        if self.available() - 1 < reserve:
+            return False
+        self.tokens -= 1
+        return True
+
+    def drain(self):
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=OMDB_BREAKER_THRESHOLD, cooldown=OMDB_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._trial = False
+
+    def allow(self):
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = 'half-open'
+            self._trial = False
+        if self.state == 'half-open':
+            # Let a single trial call through
+            if self._trial:
+                return False
+            self._trial = True
+            return True
+        return self.state == 'closed'
+
+    def record(self, ok):
+        if ok:
+            if self.state != 'closed':
+                logger.info("OMDB circuit breaker closed")
+            self.state = 'closed'
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == 'half-open' or self.failures >= self.threshold:
+            if self.state != 'open':
+                logger.warning(f"OMDB circuit breaker opened after {self.failures} failures")
+                self.opens += 1
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+    def cancel_trial(self):
+        if self.state == 'half-open':
+            self._trial = False
+
+    def retry_in(self):
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic()) if self.state == 'open' else 0.0
+
+
+class PrioritySlots:
+    """Semaphore whose waiters are woken by priority, then arrival order."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot was handed over just as we were cancelled
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # Hand the slot straight to the next waiter
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def waiting(self):
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+
+class OMDBGateway:
+    def __init__(self, concurrency):
+        self.quota = QuotaBucket()
+        self.breaker = CircuitBreaker()
+        self.slots = PrioritySlots(concurrency)
+        self.stats = {'calls': 0, 'failures': 0, 'timeouts': 0, 'rejected_breaker': 0, 'rejected_quota': 0}
+
+    def unavailable(self):
+        """Why OMDB can't be used right now, or None if it can."""
+        if self.breaker.retry_in() > 0:
+            return 'breaker'
+        if self.quota.available() < 1:
+            return 'quota'
+        return None
+
+    async def call(self, fetch, params, priority=INTERACTIVE):
+        """Run fetch(params) if the breaker and quota allow it. Returns the
+        response, or None if the call was rejected or failed."""
+        if self.breaker.retry_in() > 0:
+            self.stats['rejected_breaker'] += 1
+            return None
+        await self.slots.acquire(priority)
+        try:
+            if not self.breaker.allow():
+                self.stats['rejected_breaker'] += 1
+                return None
+            reserve = self.quota.capacity * OMDB_BACKGROUND_RESERVE if priority == BACKGROUND else 0.0
+            if not self.quota.take(reserve):
+                self.stats['rejected_quota'] += 1
+                self.breaker.cancel_trial()
+                return None
+
+            self.stats['calls'] += 1
+            try:
+                data = await asyncio.wait_for(fetch(params), OMDB_DEADLINE)
+            except asyncio.TimeoutError:
+                logger.error(f"OMDB request timed out after {OMDB_DEADLINE}s")
+                self.stats['timeouts'] += 1
+                data = None
+            except asyncio.CancelledError:
+                self.breaker.cancel_trial()
+                raise
+            if data is not None and data.get('Error') in QUOTA_ERRORS:
+                logger.error("OMDB request limit reached")
+                self.quota.drain()
+                data = None
+            if data is None:
+                self.stats['failures'] += 1
+            self.breaker.record(data is not None)
+            return data
+        finally:
+            self.slots.release()
+
+    def snapshot(self):
+        return {**self.stats, 'state': self.breaker.state, 'retry_in': self.breaker.retry_in(),
+                'opens': self.breaker.opens, 'quota': self.quota.capacity,
+                'quota_left': int(self.quota.available()), 'waiting': self.slots.waiting()}
@@ -0,0 +1,302 @@
+"""Bulk catalog importer.
+
+Streams CSV, JSONL or IMDb TSV dumps (title.basics joined with
+title.ratings) into the movies table in large batched transactions. Secondary
+indexes and the full-text index are rebuilt once at the end, and progress is
+checkpointed with every batch so an interrupted import can be resumed.
+Malformed records are skipped and counted instead of aborting the import.
+
+Usage: python main.py import <file> [--format csv|jsonl|imdb] [--ratings FILE]
+"""
+import argparse
+import csv
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import time
+
+from catalog import parse_rating, parse_year
+from db import db
+
+logger = logging.getLogger(__name__)
+
+# Indexes and triggers dropped during an import and recreated by init_db()
+DEFERRED_INDEXES = ('idx_movies_year_rating', 'idx_movies_rating', 'idx_movies_title', 'idx_movies_fetched_at')
+DEFERRED_TRIGGERS = ('movies_ai', 'movies_ad', 'movies_au')
+
+# Seconds between progress reports
+PROGRESS_INTERVAL = 5
+
+# Skipped records logged individually; the rest are only counted
+MAX_REPORTED_SKIPS = 20
+
+# Accepted spellings of each movies column in CSV/JSONL input
+FIELD_ALIASES = {
+    'title': ('title', 'primarytitle'),
+    'year': ('year', 'startyear'),
+    'genre': ('genre', 'genres'),
+    'rating': ('rating', 'imdbrating', 'averagerating'),
+    'description': ('description', 'plot'),
+    'poster_url': ('poster_url', 'poster'),
+    'imdb_id': ('imdb_id', 'imdbid', 'tconst'),
+}
+
+UPSERT_SQL = """
+    INSERT INTO movies (title, year, genre, rating, description, poster_url, imdb_id, source)
+    VALUES (?, ?, ?, ?, ?, ?, ?, 'import')
+    ON CONFLICT (imdb_id) DO UPDATE SET
+        title = excluded.title,
+        year = excluded.year,
+        genre = COALESCE(excluded.genre, movies.genre),
+        rating = COALESCE(excluded.rating, movies.rating),
+        description = COALESCE(excluded.description, movies.description),
+        poster_url = COALESCE(NULLIF(excluded.poster_url, ''), movies.poster_url)
+"""
+
+
+class BadRecord(ValueError):
+    """An input record that can't be imported; it is skipped and counted."""
+
+
+def open_text(path):
+    """Open a possibly gzip-compressed text file."""
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def dict_rows(reader):
+    """Rows of a csv.DictReader, with a BadRecord in place of each line the
+    csv module rejects."""
+    while True:
+        try:
+            yield next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield BadRecord(f"line {reader.line_num}: {e}")
+
+
+def read_csv(path):
+    with open_text(path) as f:
+        yield from dict_rows(csv.DictReader(f))
+
+
+def read_jsonl(path):
+    with open_text(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                yield {}
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield BadRecord(f"invalid JSON ({e})")
+                continue
+            yield record if isinstance(record, dict) else BadRecord("not a JSON object")
+
+
+def read_tsv(path):
+    # IMDb dumps don't quote fields and use \N for missing values
+    with open_text(path) as f:
+        for row in dict_rows(csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE)):
+            if isinstance(row, BadRecord):
+                yield row
+            else:
+                yield {key: (None if value == '\\N' else value) for key, value in row.items()}
+
+
+def imdb_number(tconst):
+    """The numeric part of a tconst, or None if it isn't one."""
+    try:
+        return int(tconst[2:])
+    except (TypeError, ValueError):
+        return None
+
+
+def join_ratings(basics, ratings):
+    """Merge title.ratings into title.basics records.
+
+    Both files are sorted by tconst, so this is a streaming merge join that
+    never holds more than one ratings row in memory.
+    """
+    ratings = (r for r in ratings if not isinstance(r, BadRecord) and imdb_number(r.get('tconst')) is not None)
+    current = next(ratings, None)
+    for record in basics:
+        number = None if isinstance(record, BadRecord) else imdb_number(record.get('tconst'))
+        if number is not None:
+            while current is not None and imdb_number(current['tconst']) < number:
+                current = next(ratings, None)
+            if current is not None and current['tconst'] == record['tconst']:
+                record['averageRating'] = current['averageRating']
+        yield record
+
+
+def normalize(record):
+    """Map an input record to a movies row, or None if it should be skipped.
+    Raises BadRecord if the record is malformed."""
+    if isinstance(record, BadRecord):
+        raise record
+    record = {key.lower(): value for key, value in record.items() if key}
+    values = {}
+    for column, aliases in FIELD_ALIASES.items():
+        values[column] = next((record[alias] for alias in aliases if record.get(alias) not in (None, '')), None)
+    if not values['title']:
+        return None
+    genre = values['genre']
+    if isinstance(genre, list):
+        genre = ', '.join(str(part) for part in genre)
+    for column in ('title', 'year', 'rating', 'description', 'poster_url', 'imdb_id'):
+        if isinstance(values[column], (dict, list)):
+            raise BadRecord(f"{column} is not a single value")
+    if isinstance(genre, str) and ',' in genre:
+        genre = ', '.join(part.strip() for part in genre.split(','))
+    return (
+        str(values['title']).strip(),
+        parse_year(str(values['year'])) if values['year'] is not None else None,
+        genre,
+        parse_rating(values['rating']),
+        values['description'],
+        values['poster_url'] or '',
+        str(values['imdb_id']) if values['imdb_id'] is not None else None,
+    )
+
+
+def imdb_records(path, ratings_path, title_types):
+    records = (r for r in read_tsv(path) if isinstance(r, BadRecord) or r.get('titleType') in title_types)
+    if ratings_path:
+        records = join_ratings(records, read_tsv(ratings_path))
+    return records
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def create_checkpoint_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS import_checkpoints
+                    (source TEXT PRIMARY KEY,
+                     position INTEGER NOT NULL,
+                     updated_at REAL NOT NULL)''')
+
+
+def load_checkpoint(conn, source):
+    row = conn.execute("SELECT position FROM import_checkpoints WHERE source = ?", (source,)).fetchone()
+    return row[0] if row else 0
+
+
+def drop_deferred_indexes(conn):
+    # init_db() rebuilds the full-text index when it finds the triggers
+    # missing, so an interrupted import is still indexed on the next start
+    for name in DEFERRED_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for name in DEFERRED_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def write_batch(conn, rows, source, position):
+    # Rows and checkpoint commit together, so a resumed import never
+    # duplicates or skips rows
+    conn.executemany(UPSERT_SQL, rows)
+    conn.execute(
+        "INSERT OR REPLACE INTO import_checkpoints (source, position, updated_at) VALUES (?, ?, ?)",
+        (source, position, time.time())
+    )
+
+
+def optimize(conn):
+    conn.execute("PRAGMA optimize")
+
+
+def run(path, fmt, init_db, ratings_path=None, batch_size=50000, restart=False,
+        title_types=('movie',)):
+    """Import a file into the movies table and return the number of rows written."""
+    source = f"{fmt}:{os.path.abspath(path)}"
+    db.write_sync(create_checkpoint_table)
+    start_position = 0 if restart else db.write_sync(load_checkpoint, source)
+    if start_position:
+        logger.info(f"Resuming import of {path} after {start_position} records")
+
+    if fmt == 'csv':
+        records = read_csv(path)
+    elif fmt == 'jsonl':
+        records = read_jsonl(path)
+    else:
+        records = imdb_records(path, ratings_path, set(title_types))
+
+    # Positions count records read from the input, so resuming is exact
+    positioned = itertools.islice(enumerate(records, 1), start_position, None)
+
+    db.write_sync(drop_deferred_indexes)
+    written = skipped = 0
+    started = last_report = time.monotonic()
+    for batch in batched(positioned, batch_size):
+        rows = []
+        for position, record in batch:
+            try:
+                row = normalize(record)
+            except BadRecord as e:
+                skipped += 1
+                if skipped <= MAX_REPORTED_SKIPS:
+                    logger.warning(f"Skipping record {position}: {e}")
+                continue
+            if row:
+                rows.append(row)
+        db.write_sync(write_batch, rows, source, batch[-1][0])
+        written += len(rows)
+
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            logger.info(f"Imported {written} rows ({written / (now - started):,.0f} rows/s)")
+
+    logger.info("Rebuilding indexes...")
+    init_db()
+    db.write_sync(optimize)
+    elapsed = time.monotonic() - started
+    logger.info(f"Imported {written} rows in {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f} rows/s)")
+    if skipped:
+        logger.warning(f"Skipped {skipped} malformed records")
+    return written
+
+
+def detect_format(path):
+    name = path.lower().removesuffix('.gz')
+    if name.endswith('.jsonl') or name.endswith('.ndjson'):
+        return 'jsonl'
+    if name.endswith('.tsv'):
+        return 'imdb'
+    return 'csv'
+
+
+def main(argv, init_db):
+    parser = argparse.ArgumentParser(prog='main.py import', description='Bulk import movies into the catalog.')
+    parser.add_argument('path', help='CSV, JSONL or IMDb title.basics TSV file (optionally .gz)')
+    parser.add_argument('--format', choices=('csv', 'jsonl', 'imdb'), help='input format (default: from file name)')
+    parser.add_argument('--ratings', help='IMDb title.ratings TSV file to join with title.basics')
+    parser.add_argument('--title-types', default='movie', help='IMDb title types to import, comma-separated')
+    parser.add_argument('--batch-size', type=int, default=50000, help='rows per transaction')
+    parser.add_argument('--restart', action='store_true', help='ignore the saved checkpoint and start over')
+    args = parser.parse_args(argv)
+
+    try:
+        run(
+            args.path,
+            args.format or detect_format(args.path),
+            init_db,
+            ratings_path=args.ratings,
+            batch_size=args.batch_size,
+            restart=args.restart,
+            title_types=tuple(args.title_types.split(',')),
+        )
+    finally:
+        db.close()
@@ -0,0 +1,227 @@
+import asyncio
+import bisect
+import logging
+import time
+
+from cache import LRUCache
+from db import db
+from suggest import normalize
+
+logger = logging.getLogger(__name__)
+
+# Results returned per inline query (Telegram allows up to 50)
+INLINE_RESULTS = 20
+
+# Prefix matches collected before ranking
+INLINE_CANDIDATES = 200
+
+# Seconds to wait for the next keystroke before searching
+INLINE_DEBOUNCE = 0.25
+
+# Seconds an inline result list stays in the in-process cache
+INLINE_CACHE_TTL = 300
+INLINE_CACHE_SIZE = 5000
+
+# Minimum seconds between catch-up scans for newly inserted movies
+SYNC_INTERVAL = 30
+
+# Catch-up batches with more keys than this are merged into the index in a
+# worker thread instead of inserted one by one on the event loop
+SYNC_INSERT_LIMIT = 64
+
+
+def _merge(keys, entries):
+    # Both lists are sorted, so timsort merges them in linear time
+    merged = keys + entries
+    merged.sort()
+    return merged
+
+
+class PrefixIndex:
+    """Sorted in-memory index of title suffixes that start at a word.
+
+    "The Dark Knight" is stored as "the dark knight", "dark knight" and
+    "knight", so typing any word of a title finds it with a binary search.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.titles = {}
+        self.max_id = 0
+        self.ready = False
+        self._last_sync = 0.0
+        # Bumped by every in-place change to keys
+        self._version = 0
+
+    @staticmethod
+    def _entries(movie_id, text):
+        words = text.split(' ')
+        return [(' '.join(words[i:]), movie_id) for i in range(len(words))]
+
+    def add(self, movie_id, title):
+        text = normalize(title or '')
+        if not text:
+            return
+        self.remove(movie_id)
+        self.titles[movie_id] = text
+        for entry in self._entries(movie_id, text):
+            bisect.insort(self.keys, entry)
+        self.max_id = max(self.max_id, movie_id)
+        self._version += 1
+
+    def remove(self, movie_id):
+        text = self.titles.pop(movie_id, None)
+        if text is None:
+            return
+        for entry in self._entries(movie_id, text):
+            i = bisect.bisect_left(self.keys, entry)
+            if i < len(self.keys) and self.keys[i] == entry:
+                del self.keys[i]
+        self._version += 1
+
+    def build(self, rows):
+        titles = {}
+        keys = []
+        for movie_id, title in rows:
+            text = normalize(title or '')
+            if text:
+                titles[movie_id] = text
+                keys.extend(self._entries(movie_id, text))
+        keys.sort()
+        self.keys, self.titles = keys, titles
+        self.max_id = max(titles, default=0)
+        self.ready = True
+
+    def search(self, query, limit=INLINE_RESULTS):
+        """Return ids of titles with a word starting with the query, titles
+        that start with it first, then shorter titles first."""
+        text = normalize(query)
+        if not text:
+            return []
+        start = bisect.bisect_left(self.keys, (text,))
+        matches = {}
+        for key, movie_id in self.keys[start:start + INLINE_CANDIDATES * 2]:
+            if not key.startswith(text):
+                break
+            title = self.titles.get(movie_id)
+            if title is None:
+                continue
+            rank = (0 if title == key else 1, len(title))
+            if movie_id not in matches or rank < matches[movie_id]:
+                matches[movie_id] = rank
+            if len(matches) >= INLINE_CANDIDATES:
+                break
+        return sorted(matches, key=matches.get)[:limit]
+
+    async def load(self, database=db):
+        started = time.monotonic()
+        rows = await database.fetchall("SELECT id, title FROM movies")
+        await asyncio.to_thread(self.build, rows)
+        self._last_sync = time.monotonic()
+        logger.info(f"Indexed {len(self.titles)} titles for inline search in {time.monotonic() - started:.1f}s")
+        await self.sync(database, force=True)
+
+    async def sync(self, database=db, force=False):
+        """Index movies inserted since the last scan (OMDB ingestion, imports).
+        Returns the number of movies added."""
+        if not self.ready or (not force and time.monotonic() - self._last_sync < SYNC_INTERVAL):
+            return 0
+        self._last_sync = time.monotonic()
+        rows = await database.fetchall("SELECT id, title FROM movies WHERE id > ? ORDER BY id", (self.max_id,))
+        titles = {}
+        entries = []
+        for movie_id, title in rows:
+            text = normalize(title or '')
+            if text and movie_id not in self.titles:
+                titles[movie_id] = text
+                entries.extend(self._entries(movie_id, text))
+        if len(entries) <= SYNC_INSERT_LIMIT:
+            for entry in entries:
+                bisect.insort(self.keys, entry)
+        else:
+            # Merge off the event loop; start over if add() or remove()
+            # changed the keys in the meantime
+            entries.sort()
+            while True:
+                version = self._version
+                merged = await asyncio.to_thread(_merge, self.keys, entries)
+                if version == self._version:
+                    break
+            self.keys = merged
+        self.titles.update(titles)
+        if rows:
+            self.max_id = max(self.max_id, rows[-1][0])
+        return len(titles)
+
+
+class _LookupAbandoned(Exception):
+    """Set on a shared lookup whose owner was cancelled before finishing."""
+
+
+class InlineSearch:
+    """Answers inline queries from the prefix index.
+
+    Result lists are cached per normalized query, identical queries in flight
+    share one lookup, and a user's query is dropped if they type another
+    character within the debounce window.
+    """
+
+    def __init__(self, index, fetch_rows):
+        self.index = index
+        self.fetch_rows = fetch_rows
+        self.cache = LRUCache(INLINE_CACHE_SIZE)
+        self._latest = {}
+        self._inflight = {}
+        self.stats = {'queries': 0, 'cache_hits': 0, 'debounced': 0, 'coalesced': 0}
+
+    def invalidate(self):
+        self.cache.clear()
+
+    async def search(self, user_id, query):
+        """Return movie rows for the query, or None if it was superseded."""
+        self.stats['queries'] += 1
+        key = normalize(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+            return cached
+
+        # Debounce: wait briefly and give up if the user kept typing
+        marker = object()
+        self._latest[user_id] = marker
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if self._latest.get(user_id) is not marker:
+            self.stats['debounced'] += 1
+            return None
+        del self._latest[user_id]
+
+        while (future := self._inflight.get(key)) is not None:
+            self.stats['coalesced'] += 1
+            try:
+                return await asyncio.shield(future)
+            except _LookupAbandoned:
+                pass  # run the lookup here instead
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if await self.index.sync():
+                # Cached result lists don't include the new movies
+                self.cache.clear()
+            rows = await self.fetch_rows(self.index.search(key))
+            self.cache.set(key, rows, time.time() + INLINE_CACHE_TTL)
+            future.set_result(rows)
+            return rows
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't warn if there are none
+            raise
+        finally:
+            if not future.done():
+                # Cancelled: let callers waiting on this lookup retry it
+                future.set_exception(_LookupAbandoned())
+                future.exception()
+            del self._inflight[key]
+
+
+prefix_index = PrefixIndex()
@@ -1,30 +1,85 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
 import logging
-import sqlite3
-import requests
+import math
 import os
 import random
+import re
+import sys
+import tempfile
+import time
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-from telegram import Update
+from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle,
+                      InputTextMessageContent, Update)
 from telegram.constants import ParseMode
-from telegram.ext import Application, CommandHandler, MessageHandler, ConversationHandler, CallbackContext
+from telegram.helpers import escape_markdown
+from telegram.ext import (Application, CallbackQueryHandler, CommandHandler, InlineQueryHandler, MessageHandler,
+                          ConversationHandler, CallbackContext)
 from telegram.ext import filters
 
+import catalog
+import importer
+import omdb
+import metrics
+import similar
+import supervisor
+from cache import OMDB_STALE_TTL, omdb_cache
+from db import db
+from gateway import BACKGROUND, INTERACTIVE
+from metrics import instrument
+from persistence import make_persistence
+from posters import poster_cache
+from query_parser import QUERY_HELP, QueryError, format_query, parse_query
+from querylog import QUERY_LOG_FLUSH_INTERVAL, query_log
+from sender import sender
+from similar import similar_index
+from snapshot import SEARCH_ENGINE, catalog_snapshot, genre_words
+from updates import create_update_handling
+from inline import INLINE_CACHE_TTL, InlineSearch, prefix_index
+from suggest import title_index
+
 # Enable logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
-# OMDB API setup (get free API key from http://www.omdbapi.com/)
-OMDB_API_KEY = os.environ.get('OMDB_API_KEY', 'YOUR_OMDB_API_KEY_HERE')
+# Answers inline queries from the in-memory prefix index
+inline_search = InlineSearch(prefix_index, lambda ids: fetch_movies_by_ids(ids))
+
+# Cache counters exported on /metrics, keyed by (cache, event)
+def cache_events():
+    caches = {'omdb': omdb_cache.stats, 'poster': poster_cache.stats, 'inline': inline_search.stats}
+    return {(name, event): value for name, stats in caches.items() for event, value in stats.items()}
+
+metrics.Gauge('bot_cache_events_total', 'Cache lookups by cache and outcome.', cache_events, ['cache', 'event'],
+              kind='counter')
+metrics.Gauge('bot_omdb_cache_hit_ratio', 'Share of OMDB lookups served from the cache.', omdb_cache.hit_rate)
+
+# Maximum number of OMDB detail lookups in flight per result page
+OMDB_DETAIL_CONCURRENCY = int(os.environ.get('OMDB_DETAIL_CONCURRENCY', 5))
+
+# Columns added to the movies table after its first release
+MOVIE_MIGRATIONS = (
+    ('imdb_id', 'TEXT'),                             # set for movies ingested from OMDB
+    ('source', "TEXT NOT NULL DEFAULT 'admin'"),     # 'admin' or 'omdb'
+    ('fetched_at', 'REAL'),                          # when OMDB data was last fetched
+)
 
 # Database setup
 def init_db():
-    conn = sqlite3.connect('movies.db')
+    db.write_sync(create_schema)
+
+# Create tables, indexes and triggers (runs inside one write transaction)
+def create_schema(conn):
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS movies
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -34,31 +89,103 @@ def init_db():
                   rating REAL,
                   description TEXT,
                   poster_url TEXT)''')
+    # Columns added after the first release; older databases are migrated in place
+    columns = {row[1] for row in c.execute("PRAGMA table_info(movies)")}
+    for name, definition in MOVIE_MIGRATIONS:
+        if name not in columns:
+            c.execute(f"ALTER TABLE movies ADD COLUMN {name} {definition}")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_movies_imdb_id ON movies (imdb_id)")
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='movies_fts'")
+    fts_exists = c.fetchone() is not None
+    # The bulk importer drops the triggers while it runs; if they are missing
+    # here an import was interrupted and the index is missing its rows
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='movies_ai'")
+    fts_stale = fts_exists and c.fetchone() is None
+    # Full-text index over the searchable text columns, kept in sync by triggers
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5
+                 (title, genre, description,
+                  content='movies', content_rowid='id',
+                  tokenize='unicode61 remove_diacritics 2')''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS movies_ai AFTER INSERT ON movies BEGIN
+                   INSERT INTO movies_fts (rowid, title, genre, description)
+                   VALUES (new.id, new.title, new.genre, new.description);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS movies_ad AFTER DELETE ON movies BEGIN
+                   INSERT INTO movies_fts (movies_fts, rowid, title, genre, description)
+                   VALUES ('delete', old.id, old.title, old.genre, old.description);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS movies_au AFTER UPDATE ON movies BEGIN
+                   INSERT INTO movies_fts (movies_fts, rowid, title, genre, description)
+                   VALUES ('delete', old.id, old.title, old.genre, old.description);
+                   INSERT INTO movies_fts (rowid, title, genre, description)
+                   VALUES (new.id, new.title, new.genre, new.description);
+                 END''')
+    if not fts_exists or fts_stale:
+        # Index movies that were added before the FTS table existed or
+        # while its triggers were dropped
+        c.execute("INSERT INTO movies_fts (movies_fts) VALUES ('rebuild')")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_year_rating ON movies (year, rating)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_rating ON movies (rating)")
+    # Catch-up scans for movies whose OMDB details were refreshed
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_fetched_at ON movies (fetched_at)")
+    # Keyset pages of /listmovies, in (title, id) order
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_title ON movies (title)")
+    # Cast and crew, normalized so actor/director filters are indexed lookups
+    c.execute('''CREATE TABLE IF NOT EXISTS people
+                 (id INTEGER PRIMARY KEY,
+                  name TEXT NOT NULL,
+                  name_norm TEXT NOT NULL UNIQUE)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS movie_people
+                 (person_id INTEGER NOT NULL,
+                  role TEXT NOT NULL,
+                  movie_id INTEGER NOT NULL,
+                  PRIMARY KEY (person_id, role, movie_id)) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movie_people_movie ON movie_people (movie_id, role)")
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS people_fts USING fts5
+                 (name, content='people', content_rowid='id',
+                  tokenize='unicode61 remove_diacritics 2')''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS people_ai AFTER INSERT ON people BEGIN
+                   INSERT INTO people_fts (rowid, name) VALUES (new.id, new.name);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS people_ad AFTER DELETE ON people BEGIN
+                   INSERT INTO people_fts (people_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS movies_people_ad AFTER DELETE ON movies BEGIN
+                   DELETE FROM movie_people WHERE movie_id = old.id;
+                 END''')
+    # Telegram file_ids of uploaded posters, and poster URLs Telegram can't fetch
+    c.execute('''CREATE TABLE IF NOT EXISTS poster_cache
+                 (poster_url TEXT PRIMARY KEY,
+                  file_id TEXT,
+                  failed_at REAL) WITHOUT ROWID''')
     c.execute('''CREATE TABLE IF NOT EXISTS admins
                  (user_id INTEGER PRIMARY KEY)''')
-    conn.commit()
-    conn.close()
+    c.execute('''CREATE TABLE IF NOT EXISTS omdb_cache
+                 (key TEXT PRIMARY KEY,
+                  response TEXT NOT NULL,
+                  expires_at REAL NOT NULL)''')
+    c.execute("DELETE FROM omdb_cache WHERE expires_at <= strftime('%s', 'now') - ?", (OMDB_STALE_TTL,))
 
 # Add initial admin (you can change this to your actual Telegram user ID)
 def add_admin(user_id):
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
-    conn.commit()
-    conn.close()
+    db.write_sync(lambda conn: conn.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,)))
 
 # Check if user is admin
-def is_admin(user_id):
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM admins WHERE user_id=?", (user_id,))
-    result = c.fetchone()
-    conn.close()
+async def is_admin(user_id):
+    result = await db.fetchone("SELECT user_id FROM admins WHERE user_id=?", (user_id,))
     return result is not None
 
 # Movie search states
 SEARCH_TITLE, SEARCH_GENRE, SEARCH_YEAR, SEARCH_ACTOR, SEARCH_DIRECTOR, SEARCH_RATING = range(6)
 
+# user_data keys filled in by the /search wizard; other keys (e.g. recent
+# /random picks) outlive a search
+WIZARD_KEYS = ('title', 'genre', 'year', 'actor', 'director', 'rating')
+
+def clear_wizard(context: CallbackContext):
+    for key in WIZARD_KEYS:
+        context.user_data.pop(key, None)
+
 # Start command
 async def start(update: Update, context: CallbackContext) -> None:
     welcome_message = (
@@ -66,7 +193,9 @@ async def start(update: Update, context: CallbackContext) -> None:
         "I can help you find information about movies.\n\n"
         "Commands:\n"
         "/search - Search for movies\n"
-        "/random - Get a random movie recommendation\n"
+        "/s - Search in one message (e.g. /s inception year:2010 rating>=8)\n"
+        "/random - Get a random movie recommendation (e.g. /random drama 7)\n"
+        "/similar <id> - Movies similar to a given one\n"
         "/admin - Admin panel (for authorized users only)\n\n"
         "Just type /search to begin finding movies!"
     )
@@ -74,9 +203,15 @@ async def start(update: Update, context: CallbackContext) -> None:
 
 # Search command handler
 async def search(update: Update, context: CallbackContext) -> int:
-    await update.message.reply_text("Please enter the movie title (or /cancel to cancel):")
+    await update.message.reply_text("Please enter the movie title (or /skip to search by other criteria, /cancel to cancel):")
     return SEARCH_TITLE
 
+# Skip title
+async def skip_title(update: Update, context: CallbackContext) -> int:
+    context.user_data['title'] = None
+    await update.message.reply_text("Enter genre (optional, press /skip to skip):")
+    return SEARCH_GENRE
+
 # Handle movie title input
 async def search_title(update: Update, context: CallbackContext) -> int:
     context.user_data['title'] = update.message.text
@@ -104,10 +239,15 @@ async def skip_year(update: Update, context: CallbackContext) -> int:
 # Handle year input
 async def search_year(update: Update, context: CallbackContext) -> int:
     try:
-        context.user_data['year'] = int(update.message.text)
+        year = int(update.message.text)
     except ValueError:
         await update.message.reply_text("Please enter a valid year (e.g., 2020) or /skip to skip:")
         return SEARCH_YEAR
+    if not catalog.MIN_YEAR <= year <= catalog.MAX_YEAR:
+        await update.message.reply_text(
+            f"Year must be between {catalog.MIN_YEAR} and {catalog.MAX_YEAR}. Please try again or /skip to skip:")
+        return SEARCH_YEAR
+    context.user_data['year'] = year
     await update.message.reply_text("Enter actor name (optional, press /skip to skip):")
     return SEARCH_ACTOR
 
@@ -160,71 +300,284 @@ async def search_rating(update: Update, context: CallbackContext) -> int:
 # Perform the actual search
 async def perform_search(update: Update, context: CallbackContext) -> int:
     # Extract search criteria
-    title = context.user_data.get('title')
-    genre = context.user_data.get('genre')
-    year = context.user_data.get('year')
-    actor = context.user_data.get('actor')
-    director = context.user_data.get('director')
-    rating = context.user_data.get('rating')
+    criteria = {
+        'title': context.user_data.get('title'),
+        'genre': context.user_data.get('genre'),
+        'year': context.user_data.get('year'),
+        'actor': context.user_data.get('actor'),
+        'director': context.user_data.get('director'),
+        'min_rating': context.user_data.get('rating'),
+    }
+    
+    # Clear the wizard's answers and end conversation
+    clear_wizard(context)
+    context.user_data.pop('search', None)
+    
+    await run_search(update, context, criteria)
+    return ConversationHandler.END
+
+# One-message search, e.g. /s inception year:2010 genre:sci-fi rating>=8 actor:"DiCaprio"
+async def quick_search(update: Update, context: CallbackContext) -> None:
+    # Parse the raw text rather than context.args so quoted values keep their spaces
+    try:
+        criteria = parse_query(update.message.text.partition(' ')[2])
+    except QueryError as e:
+        await update.message.reply_text(f"{e}\n\n{QUERY_HELP}")
+        return
+    if not any(value is not None for value in criteria.values()):
+        await update.message.reply_text(QUERY_HELP)
+        return
+    
+    context.user_data.pop('search', None)
+    await run_search(update, context, criteria)
+
+# Run a search from either the wizard or /s
+async def run_search(update: Update, context: CallbackContext, criteria):
+    query_log.record('search', format_query(criteria))
     
-    # Search in local database first
-    movies = search_movies_in_db(title, genre, year, actor, director, rating)
+    # Search in local database first, one page at a time
+    state = {'id': uuid.uuid4().hex[:8], 'criteria': criteria, 'cursors': [None], 'page': 0, 'total': None,
+             'engine': await search_engine(**criteria)}
+    movies = await send_search_page(update, state)
     
     if movies:
-        await send_movie_results(update, movies)
+        context.user_data['search'] = state
+        # Refresh OMDB-sourced results that are missing details or outdated
+        context.application.create_task(catalog.refresh_stale([movie[0] for movie in movies]))
     else:
         # If not found locally, try to fetch from OMDB API
-        omdb_movies = search_movies_in_omdb(title, year, genre)
+        omdb_movies = await search_movies_in_omdb(criteria['title'], criteria['year'], criteria['genre'])
         if omdb_movies:
             await send_omdb_movie_results(update, omdb_movies)
-        else:
+        elif criteria['title']:
             # If still not found, suggest similar movies
-            await suggest_similar_movies(update, title)
+            await suggest_similar_movies(update, criteria['title'])
+        else:
+            await update.message.reply_text("No movies found matching your criteria.")
+
+# Fetch and send one page of local search results plus Prev/Next buttons.
+# `state` holds the criteria and the keyset cursor of every page seen so far.
+async def send_search_page(update: Update, state):
+    page = state['page']
+    movies = await search_movies_in_db(**state['criteria'], after=state['cursors'][page], limit=SEARCH_PAGE_SIZE + 1,
+                                       engine=state.get('engine'))
+    if not movies:
+        return movies
     
-    # Clear user data and end conversation
-    context.user_data.clear()
-    return ConversationHandler.END
+    has_next = len(movies) > SEARCH_PAGE_SIZE
+    movies = movies[:SEARCH_PAGE_SIZE]
+    if has_next and len(state['cursors']) == page + 1:
+        last = movies[-1]
+        state['cursors'].append((last[-1], last[0]))
+    
+    await send_movie_results(update, movies)
+    
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"page:{state['id']}:{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"page:{state['id']}:{page + 1}"))
+    keyboard = similar_buttons(movies) + ([buttons] if buttons else [])
+    if keyboard:
+        if state['total'] is None:
+            state['total'] = await count_movies_in_db(**state['criteria']) if buttons else len(movies)
+        total = f"{APPROX_COUNT_LIMIT}+" if state['total'] > APPROX_COUNT_LIMIT else state['total']
+        first = page * SEARCH_PAGE_SIZE + 1
+        await sender.send_text(
+            update.effective_chat.id,
+            f"Results {first}-{first + len(movies) - 1} of {total}",
+            parse_mode=None,
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    return movies
 
-# Search movies in local database
-def search_movies_in_db(title=None, genre=None, year=None, actor=None, director=None, min_rating=None):
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
+# Handle Prev/Next buttons under search results
+async def search_page_callback(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    await query.answer()
     
-    query = "SELECT * FROM movies WHERE 1=1"
-    params = []
+    _, search_id, page = query.data.split(':')
+    page = int(page)
+    state = context.user_data.get('search')
+    if not state or state['id'] != search_id or page >= len(state['cursors']):
+        await query.edit_message_text("This search has expired. Use /search to start a new one.")
+        return
     
-    if title:
-        query += " AND title LIKE ?"
-        params.append(f"%{title}%")
+    # Only the newest navigation message keeps its buttons
+    await query.edit_message_reply_markup(reply_markup=None)
+    state['page'] = page
+    if not await send_search_page(update, state):
+        await update.effective_message.reply_text("No more results.")
+
+# "More like this" buttons for local results, one row per movie
+def similar_buttons(movies):
+    if not similar_index.ready:
+        return []
+    return [[InlineKeyboardButton(f"🔁 More like {movie[1][:40]}", callback_data=f"similar:{movie[0]}")]
+            for movie in movies]
+
+# Send the movies most similar to `movie_id`, found in the in-memory
+# similarity index without scanning the catalog
+async def send_similar_movies(update: Update, movie_id):
+    if not similar.available():
+        await update.effective_message.reply_text("Recommendations are not available on this bot.")
+        return
+    if not similar_index.ready:
+        await update.effective_message.reply_text("Recommendations are still being prepared, please try again shortly.")
+        return
     
-    if genre:
-        query += " AND genre LIKE ?"
-        params.append(f"%{genre}%")
+    await similar_index.sync()
+    ids = await asyncio.to_thread(similar_index.similar, movie_id)
+    if ids is None:
+        await update.effective_message.reply_text(f"No movie found with ID: {movie_id}")
+        return
+    movies = await fetch_movies_by_ids([movie_id, *ids])
+    if len(movies) < 2:
+        await update.effective_message.reply_text("No similar movies found.")
+        return
+    
+    await update.effective_message.reply_text(f"🎯 *Movies like {movies[0][1]}:*", parse_mode=ParseMode.MARKDOWN)
+    await send_movie_results(update, movies[1:])
+    await sender.send_text(
+        update.effective_chat.id,
+        "Want more?",
+        parse_mode=None,
+        reply_markup=InlineKeyboardMarkup(similar_buttons(movies[1:]))
+    )
+
+# /similar <id> command
+async def similar_movies(update: Update, context: CallbackContext) -> None:
+    if not context.args:
+        await update.message.reply_text("Please provide a movie ID. Usage: /similar <id>")
+        return
+    
+    try:
+        movie_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("Invalid movie ID. Please provide a numeric ID.")
+        return
+    
+    await send_similar_movies(update, movie_id)
+
+# Handle "More like this" buttons
+async def similar_callback(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    await query.answer()
+    await send_similar_movies(update, int(query.data.split(':')[1]))
+
+# Search results shown per page
+SEARCH_PAGE_SIZE = 5
+
+# Result counts above this are shown as "N+" instead of being counted exactly
+APPROX_COUNT_LIMIT = 1000
+
+# Columns selected for a movie result, in the order send_movie_results expects
+MOVIE_COLUMNS = "m.id, m.title, m.year, m.genre, m.rating, m.description, m.poster_url"
+
+# Relative BM25 weights of the title, genre and description columns
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+
+# FTS5 terms for user input. Every word becomes a quoted prefix term
+# restricted to the column, so user input can't inject FTS syntax.
+def fts_terms(column, text):
+    return [f'{column}:"{word}"*' for word in re.findall(r'\w+', text or '')]
+
+# Build an FTS5 MATCH expression for the movies_fts table
+def fts_match_expression(title=None, genre=None):
+    return ' AND '.join(fts_terms('title', title) + fts_terms('genre', genre))
+
+# Restrict results to movies with a matching actor or director. People are
+# found through the people_fts index and joined via the movie_people index.
+PEOPLE_FILTER = (" AND m.id IN (SELECT mp.movie_id FROM people_fts"
+                 " JOIN movie_people mp ON mp.person_id = people_fts.rowid"
+                 " WHERE people_fts MATCH ? AND mp.role = ?)")
+
+# Build the FROM/WHERE part of a catalog search. Returns the SQL, its
+# parameters and whether the results are ranked by full-text relevance.
+def search_conditions(title=None, genre=None, year=None, actor=None, director=None, min_rating=None):
+    match = fts_match_expression(title, genre)
+    params = []
+    
+    if match:
+        # Ranked full-text search; year/rating are applied to the joined rows
+        sql = "FROM movies_fts JOIN movies m ON m.id = movies_fts.rowid WHERE movies_fts MATCH ?"
+        params.append(match)
+    else:
+        sql = "FROM movies m WHERE 1=1"
     
     if year:
-        query += " AND year = ?"
+        sql += " AND m.year = ?"
         params.append(year)
     
     if min_rating:
-        query += " AND rating >= ?"
+        sql += " AND m.rating >= ?"
         params.append(min_rating)
     
-    # Note: Simple implementation - in a real app, you'd want more sophisticated search
-    # for actor and director fields
+    for role, name in (('actor', actor), ('director', director)):
+        name_match = ' AND '.join(fts_terms('name', name))
+        if name_match:
+            sql += PEOPLE_FILTER
+            params.extend([name_match, role])
     
-    c.execute(query, params)
-    movies = c.fetchall()
-    conn.close()
+    return sql, params, bool(match)
+
+# With SEARCH_ENGINE=memory, searches filtering only by genre, year and
+# rating are answered from the in-memory catalog snapshot, in id order like
+# the unranked SQLite query. Returns 'memory' or 'sqlite'.
+async def search_engine(title=None, genre=None, year=None, actor=None, director=None, min_rating=None):
+    if SEARCH_ENGINE != 'memory':
+        return 'sqlite'
+    await catalog_snapshot.sync()
+    return 'memory' if catalog_snapshot.can_answer(title, genre, actor, director) else 'sqlite'
+
+# Search movies in local database. Returns at most `limit` rows ordered by
+# relevance, each being MOVIE_COLUMNS followed by its score. Pass the
+# (score, id) of the last row seen as `after` to get the next page, and the
+# `engine` the first page came from so every page is in the same order.
+async def search_movies_in_db(title=None, genre=None, year=None, actor=None, director=None, min_rating=None,
+                              after=None, limit=SEARCH_PAGE_SIZE, engine=None):
+    engine = engine or await search_engine(title, genre, actor=actor, director=director)
+    if engine == 'memory' and catalog_snapshot.can_answer(title, genre, actor, director):
+        ids = await asyncio.to_thread(
+            catalog_snapshot.search, genre, year, min_rating, after_id=after[1] if after else 0, limit=limit
+        )
+        return [(*movie, 0.0) for movie in await fetch_movies_by_ids(ids)]
     
-    return movies
+    conditions, params, ranked = search_conditions(title, genre, year, actor, director, min_rating)
+    
+    # A search that started on the snapshot stays in id order
+    if ranked and engine != 'memory':
+        query = f"SELECT * FROM (SELECT {MOVIE_COLUMNS}, bm25(movies_fts, ?, ?, ?) AS score {conditions})"
+        params = [*FTS_WEIGHTS, *params]
+        if after:
+            query += " WHERE score > ? OR (score = ? AND id > ?)"
+            params.extend([after[0], after[0], after[1]])
+        query += " ORDER BY score, id LIMIT ?"
+    else:
+        query = f"SELECT {MOVIE_COLUMNS}, 0.0 AS score {conditions}"
+        if after:
+            query += " AND m.id > ?"
+            params.append(after[1])
+        query += " ORDER BY m.id LIMIT ?"
+    params.append(limit)
+    
+    return await db.fetchall(query, params)
+
+# Count matching movies, stopping once the count exceeds APPROX_COUNT_LIMIT
+async def count_movies_in_db(title=None, genre=None, year=None, actor=None, director=None, min_rating=None):
+    if await search_engine(title, genre, actor=actor, director=director) == 'memory':
+        count = await asyncio.to_thread(catalog_snapshot.count, genre, year, min_rating, limit=APPROX_COUNT_LIMIT)
+        return min(count, APPROX_COUNT_LIMIT + 1)
+    conditions, params, _ = search_conditions(title, genre, year, actor, director, min_rating)
+    row = await db.fetchone(f"SELECT count(*) FROM (SELECT 1 {conditions} LIMIT ?)", [*params, APPROX_COUNT_LIMIT + 1])
+    return row[0]
 
 # Search movies using OMDB API
-def search_movies_in_omdb(title=None, year=None, genre=None):
+async def search_movies_in_omdb(title=None, year=None, genre=None, priority=INTERACTIVE):
     if not title:
         return []
     
     params = {
-        'apikey': OMDB_API_KEY,
         's': title,  # Search term
         'type': 'movie'
     }
@@ -232,49 +585,65 @@ def search_movies_in_omdb(title=None, year=None, genre=None):
     if year:
         params['y'] = year
     
-    try:
-        response = requests.get('http://www.omdbapi.com/', params=params)
-        data = response.json()
-        
-        if data.get('Response') == 'True':
-            return data.get('Search', [])
-        else:
-            logger.info(f"OMDB API error: {data.get('Error', 'Unknown error')}")
-            return []
-    except Exception as e:
-        logger.error(f"Error fetching from OMDB API: {e}")
+    data = await omdb.request(params, priority=priority)
+    if data is None:
+        return []
+    
+    if data.get('Response') == 'True':
+        return data.get('Search', [])
+    else:
+        logger.info(f"OMDB API error: {data.get('Error', 'Unknown error')}")
         return []
 
+# Format a local movie row as a Markdown card
+def format_movie(movie):
+    movie_id, title, year, genre, rating, description, poster_url = movie[:7]
+    
+    message = f"*{title} ({year})*\n"
+    if genre:
+        message += f"Genre: {genre}\n"
+    if rating:
+        message += f"Rating: {rating}/10\n"
+    if description:
+        message += f"\n{description}\n"
+    return message
+
+# Fetch local movies by id, keeping the order of `ids`
+async def fetch_movies_by_ids(ids):
+    if not ids:
+        return []
+    rows = await db.fetchall(f"SELECT {MOVIE_COLUMNS} FROM movies m WHERE m.id IN ({', '.join('?' * len(ids))})", ids)
+    order = {movie_id: i for i, movie_id in enumerate(ids)}
+    rows.sort(key=lambda row: order[row[0]])
+    return rows
+
 # Send movie results to user
 async def send_movie_results(update: Update, movies):
     if not movies:
-        await update.message.reply_text("No movies found matching your criteria.")
+        await update.effective_message.reply_text("No movies found matching your criteria.")
         return
     
-    # Show first 5 results
-    for movie in movies[:5]:
-        movie_id, title, year, genre, rating, description, poster_url = movie
-        
-        message = f"*{title} ({year})*\n"
-        if genre:
-            message += f"Genre: {genre}\n"
-        if rating:
-            message += f"Rating: {rating}/10\n"
-        if description:
-            message += f"\n{description}\n"
-        
-        if poster_url:
-            # Send photo with caption
-            try:
-                await update.message.reply_photo(photo=poster_url, caption=message, parse_mode=ParseMode.MARKDOWN)
-            except:
-                # If photo sending fails, just send text
-                await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
-        else:
-            await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+    cards = [(format_movie(movie), movie[6]) for movie in movies]
     
-    if len(movies) > 5:
-        await update.message.reply_text(f"... and {len(movies) - 5} more movies.")
+    # Posters go out as one media group where possible
+    await sender.send_cards(update.effective_chat.id, cards)
+
+# Fetch OMDB details for one search result, limited by a shared semaphore.
+# A failed lookup yields None so it never holds up the other results.
+async def fetch_details_bounded(movie, semaphore):
+    async with semaphore:
+        try:
+            details = await get_movie_details_from_omdb(movie.get('imdbID', ''))
+        except Exception as e:
+            logger.error(f"Error fetching movie details from OMDB API: {e}")
+            details = None
+    return movie, details
+
+# Wait for queued messages, logging the ones that could not be delivered
+async def wait_for_sends(sends):
+    for result in await asyncio.gather(*sends, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to send message: {result}")
 
 # Send OMDB movie results to user
 async def send_omdb_movie_results(update: Update, movies):
@@ -282,16 +651,17 @@ async def send_omdb_movie_results(update: Update, movies):
         await update.message.reply_text("No movies found matching your criteria.")
         return
     
-    # Show first 5 results
-    for movie in movies[:5]:
+    # Fetch details for the first 5 results concurrently and render each
+    # one as soon as its lookup completes
+    semaphore = asyncio.Semaphore(OMDB_DETAIL_CONCURRENCY)
+    lookups = [fetch_details_bounded(movie, semaphore) for movie in movies[:5]]
+    sends = []
+    for lookup in asyncio.as_completed(lookups):
+        movie, details = await lookup
         title = movie.get('Title', 'N/A')
         year = movie.get('Year', 'N/A')
-        imdb_id = movie.get('imdbID', '')
         poster_url = movie.get('Poster', '')
         
-        # Get detailed info for each movie
-        details = get_movie_details_from_omdb(imdb_id)
-        
         message = f"*{title} ({year})*\n"
         if details:
             genre = details.get('Genre', 'N/A')
@@ -305,109 +675,218 @@ async def send_omdb_movie_results(update: Update, movies):
             if plot != 'No description available.':
                 message += f"\n{plot}\n"
         
-        if poster_url and poster_url != 'N/A':
-            # Send photo with caption
-            try:
-                await update.message.reply_photo(photo=poster_url, caption=message, parse_mode=ParseMode.MARKDOWN)
-            except:
-                # If photo sending fails, just send text
-                await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
-        else:
-            await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+        if poster_url == 'N/A':
+            poster_url = None
+        # Queue each card as soon as it is ready; wait for delivery at the end
+        sends.append(sender.send_card(update.effective_chat.id, message, poster_url))
     
     if len(movies) > 5:
-        await update.message.reply_text(f"... and {len(movies) - 5} more movies.")
+        sends.append(sender.send_text(update.effective_chat.id, f"... and {len(movies) - 5} more movies.", parse_mode=None))
+    await wait_for_sends(sends)
 
 # Get detailed movie info from OMDB
-def get_movie_details_from_omdb(imdb_id):
+async def get_movie_details_from_omdb(imdb_id, priority=INTERACTIVE):
     if not imdb_id:
         return None
     
     params = {
-        'apikey': OMDB_API_KEY,
         'i': imdb_id,  # IMDB ID
         'plot': 'short'
     }
     
-    try:
-        response = requests.get('http://www.omdbapi.com/', params=params)
-        data = response.json()
-        
-        if data.get('Response') == 'True':
-            return data
-        else:
-            logger.info(f"OMDB API error: {data.get('Error', 'Unknown error')}")
-            return None
-    except Exception as e:
-        logger.error(f"Error fetching movie details from OMDB API: {e}")
+    data = await omdb.request(params, priority=priority)
+    if data is None:
+        return None
+    
+    if data.get('Response') == 'True':
+        return data
+    else:
+        logger.info(f"OMDB API error: {data.get('Error', 'Unknown error')}")
         return None
 
 # Suggest similar movies
 async def suggest_similar_movies(update: Update, title):
-    # Try a broader search with just the first word of the title
+    # Look for close matches in the local catalog first
+    await title_index.sync()
+    candidates = title_index.suggest(title, limit=3)
+    if candidates:
+        rows = await fetch_movies_by_ids([movie_id for movie_id, _, _ in candidates])
+        if rows:
+            await update.message.reply_text(f"Sorry, I couldn't find '{title}'. Did you mean:")
+            await send_movie_results(update, rows)
+            return
+    
+    # Otherwise try a broader OMDB search with just the first word of the title
     first_word = title.split()[0] if title.split() else title
-    omdb_movies = search_movies_in_omdb(first_word)
+    omdb_movies = await search_movies_in_omdb(first_word)
     
     if omdb_movies:
         message = f"Sorry, I couldn't find '{title}'. Here are some similar movies:"
         await update.message.reply_text(message)
         await send_omdb_movie_results(update, omdb_movies[:3])  # Send top 3 suggestions
+    elif omdb.gateway.unavailable():
+        await update.message.reply_text(
+            "Sorry, I couldn't find any movies matching your search criteria in the local catalog. "
+            "The online movie database is unavailable right now, please try again later."
+        )
     else:
         await update.message.reply_text("Sorry, I couldn't find any movies matching your search criteria.")
 
+# Inline mode: "@bot <title>" from any chat
+async def inline_query(update: Update, context: CallbackContext) -> None:
+    query = update.inline_query
+    if not query.query.strip():
+        return
+    
+    movies = await inline_search.search(query.from_user.id, query.query)
+    if movies is None:
+        # The user kept typing; a newer query will be answered instead
+        return
+    
+    results = []
+    for movie in movies:
+        movie_id, title, year, genre, rating, description, poster_url = movie[:7]
+        details = ' · '.join(str(part) for part in (genre, rating and f"{rating}/10") if part)
+        results.append(InlineQueryResultArticle(
+            id=str(movie_id),
+            title=f"{title} ({year})",
+            description=details or None,
+            thumbnail_url=poster_url or None,
+            input_message_content=InputTextMessageContent(format_movie(movie), parse_mode=ParseMode.MARKDOWN),
+        ))
+    await query.answer(results, cache_time=INLINE_CACHE_TTL)
+
+# Keep the in-memory title indexes in step with catalog changes
+def index_movie(movie_id, title):
+    title_index.add(movie_id, title)
+    prefix_index.add(movie_id, title)
+    inline_search.invalidate()
+
+def unindex_movie(movie_id):
+    title_index.remove(movie_id)
+    prefix_index.remove(movie_id)
+    inline_search.invalidate()
+    catalog_snapshot.remove(movie_id)
+    similar_index.remove(movie_id)
+
 # Cancel search
 async def cancel(update: Update, context: CallbackContext) -> int:
-    context.user_data.clear()
+    clear_wizard(context)
     await update.message.reply_text("Search cancelled.")
     return ConversationHandler.END
 
+# How many recent /random picks per user to avoid repeating
+RANDOM_HISTORY_SIZE = 20
+
+# Extra draws made when a pick was shown to the user recently
+RANDOM_MAX_REDRAWS = 3
+
+# Exact-id probes tried before falling back to a pick among the matching rows
+RANDOM_PROBES = 8
+
+# Pick one movie at a random point of the id space, using the primary key
+# index instead of sorting the whole table. Random ids are probed directly
+# first, which keeps picks uniform. The genre filter matches like /search
+# (every word is a prefix of a genre word); probes check it on the fetched
+# row. If every probe lands in an id gap (left by /delmovie) or on a
+# filtered-out row, one of the matching rows is picked at random instead.
+# The matches are found through the genre full-text index or the rating
+# index, so that costs time in the number of matches, not the catalog size.
+def pick_random_movie(conn, genre=None, min_rating=None):
+    bounds = conn.execute("SELECT (SELECT min(id) FROM movies), (SELECT max(id) FROM movies)").fetchone()
+    if bounds[0] is None:
+        return None
+    
+    words = genre_words(genre)
+    rating_filter = ""
+    params = []
+    if min_rating is not None:
+        rating_filter = " AND m.rating >= ?"
+        params.append(min_rating)
+    
+    for _ in range(RANDOM_PROBES):
+        pivot = random.randint(bounds[0], bounds[1])
+        movie = conn.execute(
+            f"SELECT {MOVIE_COLUMNS} FROM movies m WHERE m.id = ?{rating_filter}", [pivot] + params
+        ).fetchone()
+        if movie is not None and all(
+                any(name.startswith(word) for name in genre_words(movie[3])) for word in words):
+            return movie
+    
+    if words:
+        source = "movies_fts JOIN movies m ON m.id = movies_fts.rowid WHERE movies_fts MATCH ?"
+        params.insert(0, fts_match_expression(genre=genre))
+    else:
+        source = "movies m WHERE 1=1"
+    return conn.execute(
+        f"SELECT {MOVIE_COLUMNS} FROM {source}{rating_filter} ORDER BY random() LIMIT 1", params
+    ).fetchone()
+
+# Parse "/random [genre] [min rating]" arguments, e.g. "/random drama 7".
+# Raises ValueError for a rating outside 0-10.
+def parse_random_args(args):
+    genre_words = []
+    min_rating = None
+    for arg in args:
+        try:
+            rating = float(arg)
+        except ValueError:
+            rating = None
+        if rating is None or not math.isfinite(rating):
+            genre_words.append(arg)
+        elif 0 <= rating <= 10:
+            min_rating = rating
+        else:
+            raise ValueError(f"Rating must be between 0 and 10, got {arg}")
+    return ' '.join(genre_words) or None, min_rating
+
 # Random movie recommendation
 async def random_movie(update: Update, context: CallbackContext) -> None:
-    # First try to get a random movie from local database
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute("SELECT * FROM movies ORDER BY RANDOM() LIMIT 1")
-    movie = c.fetchone()
-    conn.close()
+    try:
+        genre, min_rating = parse_random_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(f"{e}. Usage: /random [genre] [min rating], e.g. /random drama 7")
+        return
+    query_log.record('random', f"{genre or ''} {'' if min_rating is None else f'{min_rating:g}'}")
+    
+    # First try to get a random movie from local database, skipping movies
+    # this user was shown recently
+    recent = context.user_data.setdefault('recent_random', [])
+    movie = None
+    for _ in range(RANDOM_MAX_REDRAWS + 1):
+        movie = await db.read(pick_random_movie, genre, min_rating)
+        if movie is None or movie[0] not in recent:
+            break
     
     if movie:
-        movie_id, title, year, genre, rating, description, poster_url = movie
-        
-        message = f"*Random Movie Recommendation:*\n\n"
-        message += f"*{title} ({year})*\n"
-        if genre:
-            message += f"Genre: {genre}\n"
-        if rating:
-            message += f"Rating: {rating}/10\n"
-        if description:
-            message += f"\n{description}\n"
-        
-        if poster_url:
-            try:
-                await update.message.reply_photo(photo=poster_url, caption=message, parse_mode=ParseMode.MARKDOWN)
-            except:
-                await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
-        else:
-            await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+        recent.append(movie[0])
+        del recent[:-RANDOM_HISTORY_SIZE]
+    
+    if movie:
+        message = f"*Random Movie Recommendation:*\n\n" + format_movie(movie)
+        buttons = similar_buttons([movie])
+        await wait_for_sends([sender.send_card(update.effective_chat.id, message, movie[6],
+                                               reply_markup=InlineKeyboardMarkup(buttons) if buttons else None)])
+    elif (genre or min_rating is not None) and await db.fetchone("SELECT 1 FROM movies LIMIT 1"):
+        # An unrelated OMDB pick would ignore the filters
+        await update.message.reply_text("No movies match those filters. Try another genre or a lower rating.")
     else:
         # If no local movies, try to get a popular movie from OMDB
         try:
             params = {
-                'apikey': OMDB_API_KEY,
                 's': 'popular',  # Search for popular movies
                 'type': 'movie'
             }
             
-            response = requests.get('http://www.omdbapi.com/', params=params)
-            data = response.json()
+            data = await omdb.request(params)
             
-            if data.get('Response') == 'True' and data.get('Search'):
+            if data and data.get('Response') == 'True' and data.get('Search'):
                 # Pick a random movie from the results
                 random_movie = random.choice(data['Search'])
                 imdb_id = random_movie.get('imdbID', '')
                 
                 # Get detailed info
-                details = get_movie_details_from_omdb(imdb_id)
+                details = await get_movie_details_from_omdb(imdb_id)
                 
                 if details:
                     title = details.get('Title', 'N/A')
@@ -426,13 +905,9 @@ async def random_movie(update: Update, context: CallbackContext) -> None:
                     if plot != 'No description available.':
                         message += f"\n{plot}\n"
                     
-                    if poster_url and poster_url != 'N/A':
-                        try:
-                            await update.message.reply_photo(photo=poster_url, caption=message, parse_mode=ParseMode.MARKDOWN)
-                        except:
-                            await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
-                    else:
-                        await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+                    if poster_url == 'N/A':
+                        poster_url = None
+                    await wait_for_sends([sender.send_card(update.effective_chat.id, message, poster_url)])
                 else:
                     await update.message.reply_text("Unable to fetch random movie recommendation at the moment.")
             else:
@@ -441,10 +916,13 @@ async def random_movie(update: Update, context: CallbackContext) -> None:
             logger.error(f"Error fetching random movie: {e}")
             await update.message.reply_text("Unable to fetch random movie recommendation at the moment.")
 
+# Trending queries listed in /admin
+TRENDING_SHOWN = 10
+
 # Admin panel
 async def admin(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await update.message.reply_text("❌ You don't have permission to access the admin panel.")
         return
     
@@ -453,15 +931,37 @@ async def admin(update: Update, context: CallbackContext) -> None:
         "Available commands:\n"
         "/addmovie - Add a new movie\n"
         "/listmovies - List all movies\n"
-        "/delmovie <id> - Delete a movie by ID\n\n"
+        "/delmovie <id> - Delete a movie by ID\n"
+        "/exportmovies [csv|jsonl] - Download the catalog as a compressed file\n\n"
         "Use these commands to manage the movie database."
     )
+    
+    # OMDB gateway status
+    status = omdb.gateway.snapshot()
+    breaker = status['state']
+    if status['retry_in']:
+        breaker += f", retrying in {status['retry_in']:.0f}s"
+    admin_message += (
+        "\n\n*OMDB*\n"
+        f"Circuit: {breaker}\n"
+        f"Quota left: {status['quota_left']}/{status['quota']} requests\n"
+        f"Calls: {status['calls']} ({status['failures']} failed, {status['timeouts']} timed out)\n"
+        f"Rejected: {status['rejected_breaker']} by the breaker, {status['rejected_quota']} over quota\n"
+        f"Stale answers: {omdb.stats['stale_served']}, coalesced lookups: {omdb.stats['coalesced']}"
+    )
+    
+    # Most frequent queries of the last day
+    trending = await query_log.top(TRENDING_SHOWN)
+    if trending:
+        admin_message += "\n\n*Trending (24h)*\n" + "\n".join(
+            f"{count}× /{kind} {escape_markdown(query, version=1) or '(no filters)'}" for kind, query, count in trending
+        )
     await update.message.reply_text(admin_message, parse_mode=ParseMode.MARKDOWN)
 
 # Add movie command
 async def add_movie_start(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await update.message.reply_text("❌ You don't have permission to add movies.")
         return
     
@@ -472,14 +972,26 @@ async def add_movie_start(update: Update, context: CallbackContext) -> None:
         "Genre: <genre>\n"
         "Rating: <rating>\n"
         "Description: <movie description>\n"
-        "Poster: <poster URL (optional)>\n\n"
+        "Poster: <poster URL (optional)>\n"
+        "Actors: <comma-separated actors (optional)>\n"
+        "Director: <comma-separated directors (optional)>\n\n"
         "Or type /cancel to cancel."
     )
 
+# Insert an admin-provided movie together with its cast and crew
+def insert_movie(conn, movie, actors, directors):
+    cursor = conn.execute("""
+        INSERT INTO movies (title, year, genre, rating, description, poster_url)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, movie)
+    catalog.link_people(conn, cursor.lastrowid, 'actor', catalog.split_names(actors))
+    catalog.link_people(conn, cursor.lastrowid, 'director', catalog.split_names(directors))
+    return cursor.lastrowid
+
 # Handle add movie input
 async def add_movie_process(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await update.message.reply_text("❌ You don't have permission to add movies.")
         return
     
@@ -503,6 +1015,10 @@ async def add_movie_process(update: Update, context: CallbackContext) -> None:
     # Validate year
     try:
         year = int(movie_data['year'])
+        if not catalog.MIN_YEAR <= year <= catalog.MAX_YEAR:
+            await update.message.reply_text(
+                f"Year must be between {catalog.MIN_YEAR} and {catalog.MAX_YEAR}. Please try again.")
+            return
     except ValueError:
         await update.message.reply_text("Year must be a number. Please try again.")
         return
@@ -518,59 +1034,146 @@ async def add_movie_process(update: Update, context: CallbackContext) -> None:
         return
     
     # Add to database
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO movies (title, year, genre, rating, description, poster_url)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (
+    movie_id = await db.write(insert_movie, (
         movie_data['title'],
         year,
         movie_data['genre'],
         rating,
         movie_data['description'],
         movie_data.get('poster', '')
-    ))
-    conn.commit()
-    movie_id = c.lastrowid
-    conn.close()
+    ), movie_data.get('actors', ''), movie_data.get('director', ''))
+    index_movie(movie_id, movie_data['title'])
+    catalog_snapshot.add(movie_id, year, movie_data['genre'], rating)
+    similar_index.add(movie_id, year, movie_data['genre'], rating, movie_data['description'])
     
     await update.message.reply_text(f"✅ Movie added successfully with ID: {movie_id}")
 
+# Messages are split below Telegram's 4096 character limit, with headroom
+# for characters Telegram counts twice
+MESSAGE_LIMIT = 4000
+
+# Movies read per /listmovies query
+LIST_PAGE_SIZE = 500
+
+# /listmovies stops after this many messages; /exportmovies has the rest
+LIST_MAX_MESSAGES = 20
+
+# Stream movies in (title, id) order, one keyset page at a time, so only a
+# page of rows is held in memory and each query starts where the last ended
+async def stream_movie_list(page_size=LIST_PAGE_SIZE):
+    after = None
+    while True:
+        if after is None:
+            rows = await db.fetchall("SELECT id, title, year, genre FROM movies ORDER BY title, id LIMIT ?",
+                                     (page_size,))
+        else:
+            rows = await db.fetchall(
+                "SELECT id, title, year, genre FROM movies WHERE (title, id) > (?, ?) ORDER BY title, id LIMIT ?",
+                (after[0], after[1], page_size)
+            )
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        after = (rows[-1][1], rows[-1][0])
+
 # List movies command
 async def list_movies(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await update.message.reply_text("❌ You don't have permission to list movies.")
         return
     
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute("SELECT id, title, year, genre FROM movies ORDER BY title")
-    movies = c.fetchall()
-    conn.close()
+    # Lines are packed into messages as they arrive and messages only break
+    # between lines, so Markdown entities are never split
+    chat_id = update.effective_chat.id
+    message = "*Movie List:*\n\n"
+    listed = sent = 0
+    async for movie_id, title, year, genre in stream_movie_list():
+        line = escape_markdown(f"ID: {movie_id} | {title} ({year}) | {genre}", version=1)[:MESSAGE_LIMIT - 1] + "\n"
+        if len(message) + len(line) > MESSAGE_LIMIT:
+            await sender.send_text(chat_id, message)
+            sent += 1
+            message = ""
+            if sent == LIST_MAX_MESSAGES:
+                await sender.send_text(
+                    chat_id, f"Showing the first {listed} movies. Use /exportmovies for the full catalog.",
+                    parse_mode=None
+                )
+                return
+        message += line
+        listed += 1
     
-    if not movies:
+    if not listed:
         await update.message.reply_text("No movies in the database.")
         return
+    await sender.send_text(chat_id, message)
+
+# Catalog columns written by /exportmovies; `python main.py import` reads them back
+EXPORT_COLUMNS = ('id', 'title', 'year', 'genre', 'rating', 'description', 'poster_url', 'imdb_id')
+
+# Bots can upload documents of up to 50 MB
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+
+# Write the catalog to `fileobj` as gzip-compressed CSV or JSONL, streaming
+# rows from the cursor so the catalog is never held in memory. Returns the
+# number of movies written.
+def export_catalog(conn, fmt, fileobj):
+    count = 0
+    with io.TextIOWrapper(gzip.GzipFile(fileobj=fileobj, mode='wb'), encoding='utf-8', newline='') as out:
+        cursor = conn.execute(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM movies ORDER BY id")
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(EXPORT_COLUMNS)
+            for row in cursor:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in cursor:
+                out.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+# Export movies command
+async def export_movies(update: Update, context: CallbackContext) -> None:
+    user_id = update.effective_user.id
+    if not await is_admin(user_id):
+        await update.message.reply_text("❌ You don't have permission to export movies.")
+        return
     
-    message = "*Movie List:*\n\n"
-    for movie in movies:
-        movie_id, title, year, genre = movie
-        message += f"ID: {movie_id} | {title} ({year}) | {genre}\n"
-    
-    # Split message if too long
-    if len(message) > 4096:
-        chunks = [message[i:i+4096] for i in range(0, len(message), 4096)]
-        for chunk in chunks:
-            await update.message.reply_text(chunk, parse_mode=ParseMode.MARKDOWN)
-    else:
-        await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+    fmt = context.args[0].lower() if context.args else 'csv'
+    if fmt not in ('csv', 'jsonl'):
+        await update.message.reply_text("Usage: /exportmovies [csv|jsonl]")
+        return
+    
+    await update.message.reply_text("Preparing the export...")
+    # Compressed straight into a temporary file on disk
+    with tempfile.TemporaryFile() as f:
+        count = await db.read(export_catalog, fmt, f)
+        size = f.tell()
+        if size > EXPORT_MAX_BYTES:
+            await update.message.reply_text(
+                f"The export is {size / 1024 / 1024:.0f} MB, over Telegram's 50 MB upload limit."
+            )
+            return
+        f.seek(0)
+        await update.message.reply_document(
+            document=f,
+            filename=f"movies-{time.strftime('%Y%m%d')}.{fmt}.gz",
+            caption=f"{count} movies"
+        )
+
+# Delete a movie in one transaction, returning its (title,) row or None
+def delete_movie(conn, movie_id):
+    movie = conn.execute("SELECT title FROM movies WHERE id=?", (movie_id,)).fetchone()
+    if movie:
+        conn.execute("DELETE FROM movies WHERE id=?", (movie_id,))
+    return movie
 
 # Delete movie command
 async def del_movie(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await update.message.reply_text("❌ You don't have permission to delete movies.")
         return
     
@@ -584,22 +1187,46 @@ async def del_movie(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("Invalid movie ID. Please provide a numeric ID.")
         return
     
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute("SELECT title FROM movies WHERE id=?", (movie_id,))
-    movie = c.fetchone()
+    movie = await db.write(delete_movie, movie_id)
     
     if not movie:
-        conn.close()
         await update.message.reply_text(f"No movie found with ID: {movie_id}")
         return
     
-    c.execute("DELETE FROM movies WHERE id=?", (movie_id,))
-    conn.commit()
-    conn.close()
-    
+    unindex_movie(movie_id)
     await update.message.reply_text(f"✅ Movie '{movie[0]}' deleted successfully.")
 
+# Seconds between cache warming runs (0 disables the warmer)
+WARM_INTERVAL = int(os.environ.get('WARM_INTERVAL', 600))
+
+# Trending searches warmed per run
+WARM_TOP = 20
+
+# Write queued query log lines in one batch
+async def flush_query_log(context: CallbackContext) -> None:
+    await query_log.flush()
+
+# Pre-fetch what the trending searches need, following the same path as a
+# real search: the local result page, and OMDB search and detail data when
+# there are no local results. OMDB lookups are background requests, so they
+# only hit OMDB for expired entries and never eat into the interactive quota.
+async def warm_caches(context: CallbackContext) -> None:
+    warmed = 0
+    for _, query, _ in await query_log.top(WARM_TOP, kind='search'):
+        try:
+            criteria = parse_query(query)
+            movies = await search_movies_in_db(**criteria, limit=SEARCH_PAGE_SIZE + 1)
+            if not movies and criteria['title'] and not omdb.gateway.unavailable():
+                results = await search_movies_in_omdb(criteria['title'], criteria['year'], criteria['genre'],
+                                                      priority=BACKGROUND)
+                await asyncio.gather(*(get_movie_details_from_omdb(movie.get('imdbID'), priority=BACKGROUND)
+                                       for movie in results[:5]))
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Could not warm caches for {query!r}: {e}")
+    if warmed:
+        logger.info(f"Warmed caches for {warmed} trending searches")
+
 # Error handler
 async def error_handler(update: object, context: CallbackContext) -> None:
     logger.warning('Update "%s" caused error "%s"', update, context.error)
@@ -623,62 +1250,157 @@ def setup_webhook(application, token):
         application.run_polling()
         logger.info("Bot started with polling")
 
-# Main function
-def main():
-    # Initialize database
-    init_db()
-    
-    # Add your Telegram bot token here or set it as an environment variable
-    TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', 'YOUR_TELEGRAM_BOT_TOKEN')
-    
-    # Create the Application
-    application = Application.builder().token(TOKEN).build()
+# Start background services once the bot is initialized
+async def post_init(application):
+    sender.start(application.bot)
+    # Prometheus scrape endpoint, served next to the webhook on METRICS_PORT
+    application.bot_data['metrics_server'] = await metrics.start_server()
+    # Build the in-memory indexes in the background; suggestions fall back
+    # to OMDB, inline queries return nothing and "More like this" buttons are
+    # left out until they are ready
+    loop = asyncio.get_running_loop()
+    application.bot_data['index_tasks'] = [
+        loop.create_task(title_index.load()),
+        loop.create_task(prefix_index.load()),
+        loop.create_task(similar_index.load()),
+    ]
+    if SEARCH_ENGINE == 'memory':
+        # Searches use SQLite until the snapshot has loaded
+        application.bot_data['index_tasks'].append(loop.create_task(catalog_snapshot.load()))
+
+# Release shared resources when the application stops
+async def post_shutdown(application):
+    server = application.bot_data.get('metrics_server')
+    if server is not None:
+        server.close()
+    await sender.stop()
+    await query_log.flush()
+    await omdb.close()
+    db.close()
+
+# Create the Application and register all handlers. `base_url` points the
+# bot at a different Bot API server (e.g. a local one or the benchmark stub);
+# supervised workers get their updates from the supervisor, not an Updater.
+def build_application(token, base_url=None, updater=True):
+    # Updates from different chats are handled concurrently, each chat's in order
+    processor, update_queue = create_update_handling()
+    builder = (Application.builder().token(token).post_init(post_init).post_shutdown(post_shutdown)
+               .concurrent_updates(processor).update_queue(update_queue))
+    if base_url:
+        builder = builder.base_url(base_url)
+    if not updater:
+        builder = builder.updater(None)
+    persistence = make_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = builder.build()
     
     # Add conversation handler for movie search
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('search', search)],
+        entry_points=[CommandHandler('search', instrument(search))],
         states={
-            SEARCH_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_title)],
+            SEARCH_TITLE: [
+                CommandHandler('skip', instrument(skip_title)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(search_title))
+            ],
             SEARCH_GENRE: [
-                CommandHandler('skip', skip_genre),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, search_genre)
+                CommandHandler('skip', instrument(skip_genre)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(search_genre))
             ],
             SEARCH_YEAR: [
-                CommandHandler('skip', skip_year),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, search_year)
+                CommandHandler('skip', instrument(skip_year)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(search_year))
             ],
             SEARCH_ACTOR: [
-                CommandHandler('skip', skip_actor),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, search_actor)
+                CommandHandler('skip', instrument(skip_actor)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(search_actor))
             ],
             SEARCH_DIRECTOR: [
-                CommandHandler('skip', skip_director),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, search_director)
+                CommandHandler('skip', instrument(skip_director)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(search_director))
             ],
             SEARCH_RATING: [
-                CommandHandler('skip', skip_rating),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, search_rating)
+                CommandHandler('skip', instrument(skip_rating)),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(search_rating))
             ],
         },
-        fallbacks=[CommandHandler('cancel', cancel)],
+        fallbacks=[CommandHandler('cancel', instrument(cancel))],
+        name='search',
+        persistent=persistence is not None,
     )
     
     application.add_handler(conv_handler)
+    application.add_handler(CommandHandler("s", instrument(quick_search)))
     
     # Add other handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("random", random_movie))
-    application.add_handler(CommandHandler("admin", admin))
-    application.add_handler(CommandHandler("addmovie", add_movie_start))
-    application.add_handler(MessageHandler(filters.TEXT & filters.ChatType.PRIVATE, add_movie_process))
-    application.add_handler(CommandHandler("listmovies", list_movies))
-    application.add_handler(CommandHandler("delmovie", del_movie))
+    application.add_handler(CommandHandler("start", instrument(start)))
+    application.add_handler(CallbackQueryHandler(instrument(search_page_callback), pattern=r'^page:'))
+    # Non-blocking so debounced inline queries never hold up other updates
+    application.add_handler(InlineQueryHandler(instrument(inline_query), block=False))
+    application.add_handler(CommandHandler("random", instrument(random_movie)))
+    application.add_handler(CommandHandler("similar", instrument(similar_movies)))
+    application.add_handler(CallbackQueryHandler(instrument(similar_callback), pattern=r'^similar:'))
+    application.add_handler(CommandHandler("admin", instrument(admin)))
+    application.add_handler(CommandHandler("addmovie", instrument(add_movie_start)))
+    application.add_handler(MessageHandler(filters.TEXT & filters.ChatType.PRIVATE, instrument(add_movie_process)))
+    application.add_handler(CommandHandler("listmovies", instrument(list_movies)))
+    application.add_handler(CommandHandler("delmovie", instrument(del_movie)))
+    application.add_handler(CommandHandler("exportmovies", instrument(export_movies)))
     
     # Add error handler
     application.add_error_handler(error_handler)
     
+    # Batched query log writes and the cache warmer run on the JobQueue
+    if application.job_queue is None:
+        logger.warning("JobQueue not available (install python-telegram-bot[job-queue]); "
+                       "the query log is only written at shutdown and caches are not warmed")
+    else:
+        application.job_queue.run_repeating(flush_query_log, interval=QUERY_LOG_FLUSH_INTERVAL)
+        if WARM_INTERVAL:
+            application.job_queue.run_repeating(warm_caches, interval=WARM_INTERVAL, first=60)
+    return application
+
+# Main function
+def main():
+    # Initialize database
+    init_db()
+    
+    # Add your Telegram bot token here or set it as an environment variable
+    TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', 'YOUR_TELEGRAM_BOT_TOKEN')
+    
+    # Several worker processes behind one webhook port
+    WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+    if WEBHOOK_URL and supervisor.WEB_WORKERS > 1:
+        supervisor.run_supervisor(TOKEN, WEBHOOK_URL, int(os.environ.get('PORT', 8443)))
+        return
+    
+    # Create the Application
+    application = build_application(TOKEN)
+    
     # Setup webhook or polling
     setup_webhook(application, TOKEN)
 
+# Bulk import entry point: python main.py import <file> [options]
+def import_main(argv):
+    init_db()
+    importer.main(argv, init_db)
+
+# Offline build of the similarity index: python main.py similar-index
+def similar_index_main(argv):
+    init_db()
+    similar.main(argv)
+
+# Worker process started by the supervisor: python main.py worker <socket>
+def worker_main(socket_path):
+    TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', 'YOUR_TELEGRAM_BOT_TOKEN')
+    supervisor.run_worker(build_application(TOKEN, updater=False), socket_path)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == 'import':
+        import_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'similar-index':
+        similar_index_main(sys.argv[2:])
+    elif len(sys.argv) > 2 and sys.argv[1] == 'worker':
+        worker_main(sys.argv[2])
+    else:
+        main()
\ No newline at end of file
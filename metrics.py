@@ -0,0 +1,287 @@
+"""Minimal Prometheus-style metrics.
+
+Counters and histograms are kept in process and rendered in the Prometheus
+text exposition format by a small HTTP server serving GET /metrics. Values
+owned by other modules (cache stats, queue depth) are exported through
+gauge callbacks evaluated at scrape time.
+"""
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.environ.get('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9091))
+
+# Opt-in profiling: this fraction of handler calls runs under cProfile, and
+# the profile is logged when the call takes longer than PROFILE_SLOW_SECONDS
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 1.0))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_profiling = False
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        # Registering a name again replaces the old metric (e.g. gauges bound
+        # to a rebuilt Application)
+        _metrics[:] = [metric for metric in _metrics if metric.name != name]
+        _metrics.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            # Database timings are recorded from worker threads
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        # Metrics without labels are used directly
+        return self.labels()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {child.value}"]
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            if i < len(self.counts):
+                self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _render_child(self, key, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames + ('le',), key + (repr(bound),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames + ('le',), key + ('+Inf',))
+        lines.append(f"{self.name}_bucket{labels} {child.count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Value read at scrape time. `callback` returns a number, or a dict
+    mapping label value tuples to numbers. Pass kind='counter' to export
+    running totals kept elsewhere (e.g. a module's stats dict)."""
+
+    def __init__(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        self.callback = callback
+        self.kind = kind
+        super().__init__(name, documentation, labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"Gauge {self.name} failed: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Handler instrumentation
+
+HANDLER_SECONDS = Histogram('bot_handler_duration_seconds', 'Time spent in update handlers.', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Update handlers that raised an exception.', ['handler'])
+
+
+def instrument(callback, name=None):
+    """Wrap an async handler callback to record its latency and errors."""
+    name = name or callback.__name__
+    histogram = HANDLER_SECONDS.labels(handler=name)
+    errors = HANDLER_ERRORS.labels(handler=name)
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        profiler = _start_profiler()
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            histogram.observe(elapsed)
+            if profiler is not None:
+                _finish_profiler(profiler, name, elapsed)
+
+    return wrapper
+
+
+def _start_profiler():
+    global _profiling
+    # Only one profiler can be active at a time
+    if not PROFILE_SAMPLE_RATE or _profiling or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    _profiling = True
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _finish_profiler(profiler, name, elapsed):
+    global _profiling
+    profiler.disable()
+    _profiling = False
+    if elapsed < PROFILE_SLOW_SECONDS:
+        return
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(25)
+    logger.warning(f"Slow update in {name} ({elapsed:.2f}s), profile:\n{output.getvalue()}")
+
+
+# HTTP endpoint
+
+async def _handle(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', render().encode()
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics on its own port. Returns the server, or None if disabled."""
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+
+import catalog
+from cache import cache_key, omdb_cache
+from gateway import INTERACTIVE, OMDBGateway
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# OMDB API setup (get free API key from http://www.omdbapi.com/)
+OMDB_API_KEY = os.environ.get('OMDB_API_KEY', 'YOUR_OMDB_API_KEY_HERE')
+OMDB_URL = os.environ.get('OMDB_URL', 'http://www.omdbapi.com/')
+
+# Client tuning
+OMDB_TIMEOUT = float(os.environ.get('OMDB_TIMEOUT', 5))
+OMDB_CONNECT_TIMEOUT = float(os.environ.get('OMDB_CONNECT_TIMEOUT', 3))
+OMDB_MAX_CONNECTIONS = int(os.environ.get('OMDB_MAX_CONNECTIONS', 20))
+OMDB_RETRIES = int(os.environ.get('OMDB_RETRIES', 2))
+OMDB_BACKOFF = float(os.environ.get('OMDB_BACKOFF', 0.5))
+
+# Status codes worth retrying (rate limiting and upstream hiccups)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+OMDB_SECONDS = Histogram('bot_omdb_request_duration_seconds', 'OMDB API latency including retries.', ['kind'])
+OMDB_REQUESTS = Counter('bot_omdb_requests_total', 'OMDB API calls by outcome.', ['kind', 'outcome'])
+OMDB_COALESCED = Counter('bot_omdb_coalesced_total', 'OMDB lookups that joined an identical call in flight.', ['kind'])
+
+# Upstream calls in flight, by (cache key, priority); identical lookups share one
+_inflight = {}
+stats = {'upstream_calls': 0, 'coalesced': 0, 'stale_served': 0}
+
+# Quota, priorities, deadline and circuit breaker for upstream calls
+gateway = OMDBGateway(OMDB_MAX_CONNECTIONS)
+
+Gauge('bot_omdb_quota_remaining', 'OMDB requests left in the daily quota.', gateway.quota.available)
+Gauge('bot_omdb_breaker_open', 'Whether the OMDB circuit breaker is rejecting calls.',
+      lambda: int(gateway.breaker.state != 'closed'))
+
+# Shared client, created lazily so it binds to the running event loop
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OMDB_TIMEOUT, connect=OMDB_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=OMDB_MAX_CONNECTIONS,
+                max_keepalive_connections=OMDB_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+# Close the shared client (called on application shutdown)
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# Delay before the given retry attempt: exponential backoff with jitter
+def _backoff_delay(attempt):
+    return OMDB_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+async def request(params, refresh=False, priority=INTERACTIVE):
+    """Query the OMDB API and return the decoded JSON body.
+
+    Search (`s=`) and detail (`i=`) responses are served from the OMDB cache
+    when possible (unless `refresh` is set), and fresh ones are written
+    through to the local catalog. Concurrent identical lookups are merged
+    into one upstream call. Background callers pass priority=BACKGROUND.
+    If OMDB can't be reached (or the gateway rejects the call), an expired
+    cached response or the catalog's copy is returned instead, if any.
+    Returns None if the request ultimately fails.
+    """
+    cacheable = 's' in params or 'i' in params
+    if cacheable and not refresh:
+        data = await omdb_cache.get(params)
+        if data is not None:
+            return data
+
+    # Single flight: identical lookups wait for the call already in flight.
+    # The call runs as its own task so it completes (and is cached) even if
+    # the request that started it is cancelled. An INTERACTIVE call serves
+    # BACKGROUND lookups too, but not the other way round: a BACKGROUND call
+    # queues behind interactive ones and may be refused by the quota reserve.
+    kind = 'search' if 's' in params else 'detail' if 'i' in params or 't' in params else 'other'
+    key = (cache_key(params), priority)
+    task = _inflight.get((key[0], INTERACTIVE)) or _inflight.get(key)
+    if task is not None:
+        stats['coalesced'] += 1
+        OMDB_COALESCED.labels(kind=kind).inc()
+    else:
+        task = _inflight[key] = asyncio.get_running_loop().create_task(
+            _fetch_and_store(params, kind, cacheable, priority)
+        )
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def _fetch_and_store(params, kind, cacheable, priority):
+    data = await gateway.call(lambda params: _fetch_measured(params, kind), params, priority)
+    if data is None:
+        return await _stale(params) if cacheable else None
+    if cacheable:
+        await omdb_cache.set(params, data)
+        if data.get('Response') == 'True':
+            await catalog.ingest(params, data)
+    return data
+
+
+async def _fetch_measured(params, kind):
+    stats['upstream_calls'] += 1
+    started = time.perf_counter()
+    data = await _fetch(params)
+    OMDB_SECONDS.labels(kind=kind).observe(time.perf_counter() - started)
+    OMDB_REQUESTS.labels(kind=kind, outcome='error' if data is None else 'ok').inc()
+    return data
+
+
+async def _stale(params):
+    """Fallback for failed lookups: an expired cached response, or for
+    detail lookups the movie as stored in the catalog."""
+    data = await omdb_cache.get_stale(params)
+    if data is None and 'i' in params:
+        data = await catalog.local_details(params['i'])
+    if data is not None:
+        stats['stale_served'] += 1
+    return data
+
+
+async def _fetch(params):
+    """Perform the HTTP request. Transport errors, timeouts and retryable
+    status codes are retried with exponential backoff."""
+    params = {'apikey': OMDB_API_KEY, **params}
+
+    for attempt in range(OMDB_RETRIES + 1):
+        try:
+            response = await get_client().get(OMDB_URL, params=params)
+            if response.status_code in RETRY_STATUSES and attempt < OMDB_RETRIES:
+                logger.info(f"OMDB API returned {response.status_code}, retrying")
+                await asyncio.sleep(_backoff_delay(attempt))
+                continue
+            response.raise_for_status()
+            return response.json()
+        except httpx.TransportError as e:
+            if attempt < OMDB_RETRIES:
+                logger.info(f"OMDB API request failed ({e!r}), retrying")
+                await asyncio.sleep(_backoff_delay(attempt))
+                continue
+            logger.error(f"Error fetching from OMDB API: {e!r}")
+            return None
+        except (httpx.HTTPStatusError, ValueError) as e:
+            logger.error(f"Error fetching from OMDB API: {e}")
+            return None
+    return None
@@ -0,0 +1,163 @@
+"""Conversation and user state that survives restarts.
+
+SQLitePersistence stores user_data and ConversationHandler states in
+movies.db, so the /search wizard picks up where it left off after a
+restart or when a user is handed to another worker process. Backends are
+looked up by name in PERSISTENCE_BACKENDS; PERSISTENCE=none turns it off.
+"""
+import json
+import logging
+import os
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import db
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE = os.environ.get('PERSISTENCE', 'sqlite')
+
+# Seconds between flushes of changed state to the backend
+PERSISTENCE_INTERVAL = float(os.environ.get('PERSISTENCE_INTERVAL', 10))
+
+
+def create_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS persisted_data (
+            kind TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (kind, id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS persisted_conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state BLOB NOT NULL,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID
+    """)
+
+
+def _store(conn, kind, entity_id, data):
+    conn.execute("INSERT OR REPLACE INTO persisted_data (kind, id, data) VALUES (?, ?, ?)",
+                 (kind, entity_id, pickle.dumps(data)))
+
+
+def _drop(conn, kind, entity_id):
+    conn.execute("DELETE FROM persisted_data WHERE kind=? AND id=?", (kind, entity_id))
+
+
+def _store_conversation(conn, name, key, state):
+    if state is None:
+        conn.execute("DELETE FROM persisted_conversations WHERE name=? AND key=?", (name, key))
+    else:
+        conn.execute("INSERT OR REPLACE INTO persisted_conversations (name, key, state) VALUES (?, ?, ?)",
+                     (name, key, pickle.dumps(state)))
+
+
+class SQLitePersistence(BasePersistence):
+    """Keeps user_data and conversations in SQLite tables.
+
+    bot_data holds runtime objects (tasks, servers) and is not persisted.
+    chat_data isn't used by the bot and, with updates routed to workers by
+    user, a group's chat_data could be written by several of them, so it
+    isn't persisted either. State is pickled, like PicklePersistence does.
+    """
+
+    def __init__(self, database=db, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = database
+        self._ready = False
+
+    async def _setup(self):
+        if not self._ready:
+            await self.db.write(create_tables)
+            self._ready = True
+
+    async def _load(self, kind):
+        await self._setup()
+        rows = await self.db.fetchall("SELECT id, data FROM persisted_data WHERE kind=?", (kind,))
+        result = {}
+        for entity_id, data in rows:
+            try:
+                result[entity_id] = pickle.loads(data)
+            except Exception as e:
+                logger.warning(f"Dropping unreadable {kind} for {entity_id}: {e}")
+        return result
+
+    async def get_user_data(self):
+        return await self._load('user')
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        await self._setup()
+        rows = await self.db.fetchall("SELECT key, state FROM persisted_conversations WHERE name=?", (name,))
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        await self._setup()
+        await self.db.write(_store_conversation, name, json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        await self._setup()
+        await self.db.write(_store, 'user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._setup()
+        await self.db.write(_drop, 'user', user_id)
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    # Each user is served by a single worker process (see supervisor.py), so
+    # the in-memory user_data is always the newest copy
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass
+
+
+PERSISTENCE_BACKENDS = {
+    'sqlite': SQLitePersistence,
+}
+
+
+def make_persistence(name=PERSISTENCE):
+    """Return the configured persistence backend, or None if disabled."""
+    if not name or name == 'none':
+        return None
+    try:
+        return PERSISTENCE_BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown PERSISTENCE backend {name!r}, expected one of "
+                         f"{sorted(PERSISTENCE_BACKENDS)} or 'none'") from None
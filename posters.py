@@ -0,0 +1,91 @@
+import logging
+import os
+import sqlite3
+import time
+
+from cache import LRUCache
+from db import db
+
+logger = logging.getLogger(__name__)
+
+# Poster URLs Telegram failed to fetch are skipped for this many seconds
+POSTER_BAD_TTL = int(os.environ.get('POSTER_BAD_TTL', 24 * 3600))
+
+# Entries kept in memory; unknown URLs are re-checked in SQLite after a while
+POSTER_CACHE_SIZE = int(os.environ.get('POSTER_CACHE_SIZE', 10000))
+UNKNOWN_TTL = 600
+FILE_ID_TTL = 30 * 24 * 3600
+
+
+class PosterCache:
+    """Maps poster URLs to the Telegram file_id of an earlier upload.
+
+    Re-sending a file_id skips Telegram's download of the poster URL. URLs
+    Telegram could not fetch are remembered too, so cards using them go
+    straight to text. Entries live in memory and in the poster_cache table.
+    """
+
+    def __init__(self, database=db, maxsize=POSTER_CACHE_SIZE):
+        self.db = database
+        self.memory = LRUCache(maxsize)
+        self.stats = {'file_id_hits': 0, 'bad_skips': 0, 'uploads': 0, 'failures': 0}
+
+    async def lookup(self, url):
+        """Return ('file_id', id), ('bad', None) or (None, None) for a URL."""
+        now = time.time()
+        entry = self.memory.get(url, now)
+        if entry is None:
+            try:
+                row = await self.db.fetchone("SELECT file_id, failed_at FROM poster_cache WHERE poster_url = ?", (url,))
+            except sqlite3.Error as e:
+                logger.error(f"Poster cache read failed: {e}")
+                row = None
+            entry, expires_at = self._entry(row, now)
+            self.memory.set(url, entry, expires_at)
+
+        if entry[0] == 'file_id':
+            self.stats['file_id_hits'] += 1
+        elif entry[0] == 'bad':
+            self.stats['bad_skips'] += 1
+        return entry
+
+    def _entry(self, row, now):
+        """The memory entry for a poster_cache row and when it expires. Bad
+        URLs expire when their POSTER_BAD_TTL runs out, not a full
+        FILE_ID_TTL later."""
+        if row is None:
+            return (None, None), now + UNKNOWN_TTL
+        file_id, failed_at = row
+        if failed_at and now - failed_at < POSTER_BAD_TTL:
+            return ('bad', None), failed_at + POSTER_BAD_TTL
+        if file_id:
+            return ('file_id', file_id), now + FILE_ID_TTL
+        return (None, None), now + UNKNOWN_TTL
+
+    async def remember(self, url, file_id):
+        self.stats['uploads'] += 1
+        now = time.time()
+        self.memory.set(url, ('file_id', file_id), now + FILE_ID_TTL)
+        await self._store(url, file_id, None)
+
+    async def mark_bad(self, url):
+        self.stats['failures'] += 1
+        now = time.time()
+        self.memory.set(url, ('bad', None), now + POSTER_BAD_TTL)
+        await self._store(url, None, now)
+
+    async def forget(self, url):
+        self.memory.set(url, (None, None), time.time() + UNKNOWN_TTL)
+        await self._store(url, None, None)
+
+    async def _store(self, url, file_id, failed_at):
+        try:
+            await self.db.execute(
+                "INSERT OR REPLACE INTO poster_cache (poster_url, file_id, failed_at) VALUES (?, ?, ?)",
+                (url, file_id, failed_at)
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Poster cache write failed: {e}")
+
+
+poster_cache = PosterCache()
@@ -0,0 +1,101 @@
+"""One-message search queries for /s.
+
+    /s inception year:2010 genre:sci-fi rating>=8 actor:"DiCaprio"
+
+Free words (and "quoted phrases") make up the title. Fields are written as
+name:value, with double quotes around values containing spaces; repeating
+a text field narrows the search further (genre:crime genre:drama). The
+result has the same keys as the /search wizard's criteria, and
+format_query() turns criteria back into a normalized query.
+"""
+import re
+
+# Field names and their aliases -> criteria key
+FIELDS = {
+    'title': 'title', 't': 'title',
+    'genre': 'genre', 'g': 'genre',
+    'year': 'year', 'y': 'year',
+    'actor': 'actor', 'a': 'actor', 'cast': 'actor',
+    'director': 'director', 'd': 'director', 'dir': 'director',
+    'rating': 'min_rating', 'r': 'min_rating',
+}
+
+QUERY_HELP = (
+    "Usage: /s <title> [genre:<genre>] [year:<year>] [actor:<name>] [director:<name>] [rating>=<0-10>]\n"
+    "Example: /s inception year:2010 genre:sci-fi rating>=8 actor:\"DiCaprio\""
+)
+
+_token = re.compile(r'(?:(?P<field>[A-Za-z]+)(?P<op>>=|:|=|>|<=|<))?(?P<value>"[^"]*"?|\S+)')
+
+
+class QueryError(ValueError):
+    """A query that can't be parsed; the message is meant for the user."""
+
+
+def _unquote(value):
+    if value.startswith('"'):
+        return value[1:-1] if len(value) > 1 and value.endswith('"') else value[1:]
+    return value
+
+
+def parse_query(text):
+    """Parse a query into search criteria. Raises QueryError for malformed
+    fields."""
+    criteria = {'title': None, 'genre': None, 'year': None, 'actor': None, 'director': None, 'min_rating': None}
+    words = {'title': [], 'genre': [], 'actor': [], 'director': []}
+
+    for match in _token.finditer(text or ''):
+        field, op, value = match.group('field'), match.group('op'), _unquote(match.group('value'))
+        key = FIELDS.get(field.lower()) if field else None
+        if key is None:
+            # Not a field, e.g. "Mission:" in a title
+            words['title'].append(_unquote(match.group(0)))
+            continue
+
+        if key == 'min_rating':
+            if op not in (':', '=', '>='):
+                raise QueryError("Filter by minimum rating with rating>=N, e.g. rating>=7.5")
+            try:
+                rating = float(value)
+            except ValueError:
+                raise QueryError(f"Invalid rating {value!r}, expected a number from 0 to 10") from None
+            if not 0 <= rating <= 10:
+                raise QueryError("Rating must be between 0 and 10")
+            criteria['min_rating'] = rating
+        elif op not in (':', '='):
+            raise QueryError(f"Use {field}:<value> to filter by {field}")
+        elif key == 'year':
+            if criteria['year'] is not None:
+                raise QueryError("Only one year can be given")
+            try:
+                criteria['year'] = int(value)
+            except ValueError:
+                raise QueryError(f"Invalid year {value!r}, expected e.g. year:2020") from None
+        elif value:
+            words[key].append(value)
+
+    for key, values in words.items():
+        criteria[key] = ' '.join(values) or None
+    return criteria
+
+
+def _clean(value):
+    return ' '.join(str(value).lower().replace('"', ' ').split())
+
+
+def format_query(criteria):
+    """Render criteria as a normalized /s query that parse_query reads back:
+    lowercase, single spaces and fields in a fixed order."""
+    parts = []
+    title = _clean(criteria.get('title') or '')
+    if title:
+        parts.append(f'"{title}"' if ':' in title or '=' in title or '>' in title else title)
+    for key in ('genre', 'actor', 'director'):
+        value = _clean(criteria.get(key) or '')
+        if value:
+            parts.append(f'{key}:"{value}"' if ' ' in value else f'{key}:{value}')
+    if criteria.get('year') is not None:
+        parts.append(f"year:{criteria['year']}")
+    if criteria.get('min_rating') is not None:
+        parts.append(f"rating>={criteria['min_rating']:g}")
+    return ' '.join(parts)
@@ -0,0 +1,102 @@
+"""Append-only log of user queries, used to find trending searches.
+
+Handlers only append to an in-memory buffer; a JobQueue task writes the
+buffer out in one batch every few seconds from a worker thread. Each line
+is `<unix time>\t<kind>\t<normalized query>` and the file is rotated once
+it grows past QUERY_LOG_MAX_BYTES, keeping QUERY_LOG_BACKUPS old files.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, deque
+
+from db import DB_PATH
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG_PATH = os.environ.get('QUERY_LOG_PATH', f"{DB_PATH}.queries")
+QUERY_LOG_MAX_BYTES = int(os.environ.get('QUERY_LOG_MAX_BYTES', 8 * 1024 * 1024))
+QUERY_LOG_BACKUPS = int(os.environ.get('QUERY_LOG_BACKUPS', 2))
+
+# Seconds between batched writes
+QUERY_LOG_FLUSH_INTERVAL = 5
+
+# Queries held in memory between writes; the oldest are dropped beyond this
+QUERY_LOG_BUFFER = 10000
+
+# Queries count towards trends for this many seconds
+TRENDING_WINDOW = 86400
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().replace('\t', ' ').split())
+
+
+class QueryLog:
+    def __init__(self, path=QUERY_LOG_PATH, max_bytes=QUERY_LOG_MAX_BYTES, backups=QUERY_LOG_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._buffer = deque(maxlen=QUERY_LOG_BUFFER)
+        self.stats = {'recorded': 0, 'written': 0, 'rotations': 0}
+
+    def record(self, kind, query):
+        self._buffer.append(f"{int(time.time())}\t{kind}\t{normalize(query)}\n")
+        self.stats['recorded'] += 1
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.stats['rotations'] += 1
+
+    def _write(self, lines):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+            size = f.tell()
+        if size >= self.max_bytes:
+            self._rotate()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        lines = list(self._buffer)
+        self._buffer.clear()
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self.stats['written'] += len(lines)
+        except OSError as e:
+            logger.error(f"Could not write query log {self.path}: {e}")
+
+    def _count(self, since, kind):
+        counts = Counter()
+        paths = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)] + [self.path]
+        for path in paths:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    for line in f:
+                        stamp, _, rest = line.rstrip('\n').partition('\t')
+                        line_kind, _, query = rest.partition('\t')
+                        if (kind is None or line_kind == kind) and stamp.isdigit() and int(stamp) >= since:
+                            counts[line_kind, query] += 1
+            except FileNotFoundError:
+                continue
+        return counts
+
+    async def top(self, limit=10, kind=None, window=TRENDING_WINDOW):
+        """The most frequent (kind, query, count) entries of the last `window` seconds."""
+        await self.flush()
+        counts = await asyncio.to_thread(self._count, time.time() - window, kind)
+        return [(line_kind, query, count) for (line_kind, query), count in counts.most_common(limit)]
+
+
+query_log = QueryLog()
+
+Gauge('bot_query_log_total', 'Query log events by type.',
+      lambda: {(event,): value for event, value in query_log.stats.items()}, ['event'], kind='counter')
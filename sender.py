@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from telegram import InputMediaPhoto
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from metrics import Gauge, Histogram
+from posters import poster_cache
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and about one per
+# second per chat, with short bursts tolerated
+SEND_GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', 25))
+SEND_GLOBAL_BURST = int(os.environ.get('SEND_GLOBAL_BURST', 30))
+SEND_CHAT_RATE = float(os.environ.get('SEND_CHAT_RATE', 1))
+SEND_CHAT_BURST = int(os.environ.get('SEND_CHAT_BURST', 5))
+
+# Network errors and RetryAfter responses are retried this many times
+SEND_MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', 3))
+
+# Photo captions longer than this are rejected by Telegram
+CAPTION_LIMIT = 1024
+
+# Albums hold 2 to 10 photos
+MEDIA_GROUP_MAX = 10
+
+# Idle per-chat workers exit after this many seconds
+CHAT_IDLE_TIMEOUT = 30
+
+# Fragments of BadRequest messages that blame the photo rather than the caption
+POSTER_ERRORS = ('url', 'file', 'web page content', 'image_process_failed')
+
+SEND_SECONDS = Histogram('bot_telegram_send_duration_seconds', 'Latency of Telegram Bot API send calls.', ['method'])
+DELIVERY_SECONDS = Histogram('bot_telegram_delivery_seconds', 'Time from queueing a message to Telegram accepting it.')
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, cost=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+class Job:
+    __slots__ = ('method', 'kwargs', 'fallback', 'posters', 'sources', 'future', 'enqueued_at')
+
+    def __init__(self, method, kwargs, fallback=None, posters=None):
+        self.method = method
+        self.kwargs = kwargs
+        # Jobs to run instead if Telegram rejects this one (e.g. a bad poster URL)
+        self.fallback = fallback or []
+        # Poster URLs of a photo or media group job, and what is actually sent
+        # for each (the URL or a cached file_id)
+        self.posters = posters or []
+        self.sources = list(self.posters)
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class OutboundScheduler:
+    """Central queue for outgoing result messages.
+
+    Every chat gets a FIFO queue drained by its own worker, so messages to one
+    chat keep their order while different chats are served in parallel. Sends
+    are paced by a per-chat and a global token bucket, RetryAfter responses
+    pause sending for the requested time, and consecutive posters are sent as
+    a single media group.
+    """
+
+    def __init__(self):
+        self.bot = None
+        self.global_bucket = None
+        self._chats = {}
+        self._paused_until = 0.0
+        self.latencies = deque(maxlen=1000)
+        self.stats = {'sent': 0, 'failed': 0, 'retry_after': 0, 'media_groups': 0, 'fallbacks': 0}
+
+    def start(self, bot):
+        self.bot = bot
+        self.global_bucket = TokenBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_BURST)
+
+    async def stop(self):
+        # Let queued messages go out before shutting down
+        entries = list(self._chats.values())
+        if entries:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(queue.join() for queue, _ in entries)), CHAT_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropping {self.queue_depth()} queued messages on shutdown")
+        for _, worker in entries:
+            worker.cancel()
+        self._chats.clear()
+
+    def queue_depth(self):
+        return sum(queue.qsize() for queue, _ in self._chats.values())
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+        return {**self.stats, 'queue_depth': self.queue_depth(), 'chats': len(self._chats),
+                'latency_p50': percentile(0.5), 'latency_p95': percentile(0.95)}
+
+    def _enqueue(self, chat_id, job):
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            queue = asyncio.Queue()
+            worker = asyncio.get_running_loop().create_task(self._chat_worker(chat_id, queue))
+            entry = self._chats[chat_id] = (queue, worker)
+        entry[0].put_nowait(job)
+        return job.future
+
+    async def _chat_worker(self, chat_id, queue):
+        bucket = TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST)
+        while True:
+            try:
+                job = await asyncio.wait_for(queue.get(), CHAT_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    self._chats.pop(chat_id, None)
+                    return
+                continue
+            try:
+                result = await self._run(job, bucket)
+            except Exception as e:
+                self.stats['failed'] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                else:
+                    logger.warning(f"Failed to send message to chat {chat_id}: {e}")
+            else:
+                latency = time.monotonic() - job.enqueued_at
+                self.latencies.append(latency)
+                DELIVERY_SECONDS.observe(latency)
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                queue.task_done()
+
+    async def _prepare(self, job):
+        """Swap poster URLs for cached file_ids. Returns False if one of the
+        posters is known to be unusable."""
+        for i, url in enumerate(job.posters):
+            status, file_id = await poster_cache.lookup(url)
+            if status == 'bad':
+                return False
+            job.sources[i] = file_id or url
+        if job.method == 'send_photo':
+            job.kwargs['photo'] = job.sources[0]
+        elif job.posters:
+            job.kwargs['media'] = [
+                InputMediaPhoto(media=source, caption=item.caption, parse_mode=item.parse_mode)
+                for source, item in zip(job.sources, job.kwargs['media'])
+            ]
+        return True
+
+    async def _remember_posters(self, job, result):
+        messages = result if job.method == 'send_media_group' else [result]
+        for url, source, message in zip(job.posters, job.sources, messages):
+            if source == url and getattr(message, 'photo', None):
+                await poster_cache.remember(url, message.photo[-1].file_id)
+
+    async def _run_fallback(self, job, bucket):
+        self.stats['fallbacks'] += 1
+        result = None
+        for fallback in job.fallback:
+            result = await self._run(fallback, bucket)
+        return result
+
+    async def _run(self, job, bucket):
+        if job.posters and not await self._prepare(job):
+            return await self._run_fallback(job, bucket)
+
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                with SEND_SECONDS.labels(method=job.method).time():
+                    result = await getattr(self.bot, job.method)(**job.kwargs)
+                self.stats['sent'] += 1
+                if job.method == 'send_media_group':
+                    self.stats['media_groups'] += 1
+                if job.posters:
+                    await self._remember_posters(job, result)
+                return result
+            except RetryAfter as e:
+                self.stats['retry_after'] += 1
+                delay = e.retry_after
+                if hasattr(delay, 'total_seconds'):
+                    delay = delay.total_seconds()
+                logger.warning(f"Flood limit hit, pausing sends for {delay}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                if attempt == SEND_MAX_RETRIES:
+                    raise
+            except BadRequest as e:
+                if job.method == 'send_photo' and any(error in str(e).lower() for error in POSTER_ERRORS):
+                    if job.sources[0] == job.posters[0]:
+                        await poster_cache.mark_bad(job.posters[0])
+                    else:
+                        # The cached file_id is no longer valid
+                        await poster_cache.forget(job.posters[0])
+                if not job.fallback:
+                    raise
+                return await self._run_fallback(job, bucket)
+            except NetworkError:
+                if attempt == SEND_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    def send_text(self, chat_id, text, parse_mode=ParseMode.MARKDOWN, **kwargs):
+        """Queue a text message; returns a future for the sent Message."""
+        return self._enqueue(chat_id, Job('send_message', {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode, **kwargs}))
+
+    def send_card(self, chat_id, text, poster_url=None, parse_mode=ParseMode.MARKDOWN, reply_markup=None):
+        """Queue a movie card: the poster with the text as caption, or just
+        the text if there is no usable poster."""
+        return self._enqueue(chat_id, self._card_job(chat_id, text, poster_url, parse_mode, reply_markup))
+
+    def _card_job(self, chat_id, text, poster_url, parse_mode, reply_markup=None):
+        extra = {'reply_markup': reply_markup} if reply_markup is not None else {}
+        text_job = Job('send_message', {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode, **extra})
+        if not poster_url or len(text) > CAPTION_LIMIT:
+            return text_job
+        return Job('send_photo', {'chat_id': chat_id, 'photo': poster_url, 'caption': text, 'parse_mode': parse_mode,
+                                  **extra},
+                   fallback=[text_job], posters=[poster_url])
+
+    async def send_cards(self, chat_id, cards, parse_mode=ParseMode.MARKDOWN):
+        """Send (text, poster_url) cards in order, batching runs of posters
+        into media groups. Waits until every card has been sent."""
+        futures = []
+        run = []
+
+        def flush():
+            if len(run) == 1:
+                futures.append(self.send_card(chat_id, *run[0], parse_mode=parse_mode))
+            elif run:
+                media = [InputMediaPhoto(media=url, caption=text, parse_mode=parse_mode) for text, url in run]
+                fallback = [self._card_job(chat_id, text, url, parse_mode) for text, url in run]
+                job = Job('send_media_group', {'chat_id': chat_id, 'media': media}, fallback, [url for _, url in run])
+                futures.append(self._enqueue(chat_id, job))
+            run.clear()
+
+        for text, poster_url in cards:
+            if poster_url and len(text) <= CAPTION_LIMIT:
+                run.append((text, poster_url))
+                if len(run) == MEDIA_GROUP_MAX:
+                    flush()
+            else:
+                flush()
+                futures.append(self.send_card(chat_id, text, None, parse_mode))
+        flush()
+
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to send movie card: {result}")
+        return results
+
+
+sender = OutboundScheduler()
+
+Gauge('bot_telegram_queue_depth', 'Messages waiting in the outbound queue.', sender.queue_depth)
+Gauge('bot_telegram_messages_total', 'Outbound queue events by type.',
+      lambda: {(event,): value for event, value in sender.stats.items()}, ['event'], kind='counter')
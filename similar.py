@@ -0,0 +1,335 @@
+"""Content-based "more like this" recommendations.
+
+Every movie gets a fixed-length feature vector built from its genre words,
+release year, rating and description terms, normalized so that the dot
+product of two vectors is their cosine similarity. All vectors live in one
+float32 matrix, so the neighbours of a movie are found with a single
+matrix-vector product and a partial sort, without touching the database.
+
+The index is built offline with `python main.py similar-index` and saved
+next to the database; the bot loads the file at startup, catches up on
+movies added or deleted since, and updates it incrementally afterwards. If
+there is no index file yet the bot builds (and saves) one in the
+background. Changes to existing movies are picked up by the next rebuild.
+Feature vectors are computed in worker threads, never on the event loop.
+
+The index needs NumPy; without it the feature is disabled.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import struct
+import time
+import zlib
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from db import DB_PATH, db
+
+logger = logging.getLogger(__name__)
+
+SIMILAR_INDEX_PATH = os.environ.get('SIMILAR_INDEX_PATH', f"{DB_PATH}.similar")
+
+# Recommendations shown per movie
+SIMILAR_COUNT = 5
+
+# Vector layout: one dimension per common genre word, hashed description
+# terms, then (cos, sin) pairs placing year and rating on a quarter circle
+GENRE_DIMS = 24
+TERM_DIMS = 20
+DIMS = GENRE_DIMS + TERM_DIMS + 4
+
+# Share of each feature group in the similarity (L2 norm of its block)
+GENRE_WEIGHT = 0.6
+TERM_WEIGHT = 0.45
+YEAR_WEIGHT = 0.45
+RATING_WEIGHT = 0.35
+
+YEAR_RANGE = (1880, 2030)
+
+# Description terms found in fewer documents than this are ignored
+MIN_TERM_DF = 2
+
+# Minimum seconds between catch-up scans for newly inserted movies
+SYNC_INTERVAL = 30
+
+# Rows vectorized per batch while building the index
+BUILD_BATCH = 10000
+
+STOPWORDS = frozenset("""
+    about after again against all also and any are because been before being between both but can could
+    did does doing down during each few for from further had has have having her here hers herself him
+    himself his how into its itself just more most must not now off once only other our ours out over own
+    same she should some such than that the their theirs them then there these they this those through too
+    under until very was were what when where which while who whom why will with would you your yours
+""".split())
+
+MAGIC = b'KSIMIDX1'
+_header = struct.Struct('<8sIIIq')
+
+
+def genre_words(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def description_terms(text):
+    return [word for word in re.findall(r'[a-z]{3,}', (text or '').lower()) if word not in STOPWORDS]
+
+
+def _scaled(values, weight):
+    norm = math.sqrt(sum(value * value for value in values))
+    return [value * weight / norm for value in values] if norm else values
+
+
+def _angle(value, low, high):
+    value = min(max(value, low), high)
+    angle = (value - low) / (high - low) * math.pi / 2
+    return [math.cos(angle), math.sin(angle)]
+
+
+def available():
+    return np is not None
+
+
+class SimilarIndex:
+    def __init__(self):
+        self.size = 0
+        self.capacity = 0
+        if np is not None:
+            self.ids = np.zeros(0, dtype='int64')
+            self.alive = np.zeros(0, dtype='uint8')
+            self.vectors = np.zeros((0, DIMS), dtype='float32')
+        # genre word -> dimension, description term -> inverse document frequency
+        self.genres = {}
+        self.idf = {}
+        self.max_id = 0
+        self.ready = False
+        self._last_sync = 0.0
+
+    # Features
+
+    def vectorize(self, year, genre, rating, description):
+        genre_part = [0.0] * GENRE_DIMS
+        for word in genre_words(genre):
+            dim = self.genres.get(word)
+            if dim is not None:
+                genre_part[dim] = 1.0
+
+        # Signed feature hashing keeps collisions from adding up
+        term_part = [0.0] * TERM_DIMS
+        for term, count in Counter(description_terms(description)).items():
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            digest = zlib.crc32(term.encode())
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            term_part[digest % TERM_DIMS] += sign * (1 + math.log(count)) * idf
+
+        year_part = _angle(year, *YEAR_RANGE) if year else [0.0, 0.0]
+        rating_part = _angle(rating, 0, 10) if rating is not None else [0.0, 0.0]
+        vector = (_scaled(genre_part, GENRE_WEIGHT) + _scaled(term_part, TERM_WEIGHT)
+                  + _scaled(year_part, YEAR_WEIGHT) + _scaled(rating_part, RATING_WEIGHT))
+        return _scaled(vector, 1.0)
+
+    def vectorize_rows(self, rows):
+        """Vectors of (id, year, genre, rating, description) rows as one matrix."""
+        return np.array([self.vectorize(*row[1:]) for row in rows], dtype='float32').reshape(len(rows), DIMS)
+
+    def fit(self, conn):
+        """Choose genre dimensions and description term weights from the catalog."""
+        genre_counts = Counter()
+        term_df = Counter()
+        documents = 0
+        for genre, description in conn.execute("SELECT genre, description FROM movies"):
+            genre_counts.update(set(genre_words(genre)))
+            term_df.update(set(description_terms(description)))
+            documents += 1
+        self.genres = {word: dim for dim, (word, _) in enumerate(genre_counts.most_common(GENRE_DIMS))}
+        self.idf = {term: math.log((1 + documents) / (1 + df)) + 1
+                    for term, df in term_df.items() if df >= MIN_TERM_DF}
+
+    # Storage
+
+    def _grow(self, capacity):
+        ids = np.zeros(capacity, dtype='int64')
+        alive = np.zeros(capacity, dtype='uint8')
+        vectors = np.zeros((capacity, DIMS), dtype='float32')
+        ids[:self.size] = self.ids[:self.size]
+        alive[:self.size] = self.alive[:self.size]
+        vectors[:self.size] = self.vectors[:self.size]
+        self.ids, self.alive, self.vectors, self.capacity = ids, alive, vectors, capacity
+
+    def _position(self, movie_id):
+        return int(np.searchsorted(self.ids[:self.size], movie_id))
+
+    def _row(self, movie_id):
+        i = self._position(movie_id)
+        if i < self.size and self.ids[i] == movie_id and self.alive[i]:
+            return i
+        return None
+
+    def _put(self, movie_id, vector):
+        i = self._position(movie_id)
+        if i < self.size and self.ids[i] == movie_id:
+            self.vectors[i] = vector
+            self.alive[i] = 1
+            return
+        if self.size == self.capacity:
+            self._grow(max(self.capacity * 2, 1024))
+        if i < self.size:
+            # Reused id below the maximum: shift the tail up by one row
+            self.ids[i + 1:self.size + 1] = self.ids[i:self.size].copy()
+            self.alive[i + 1:self.size + 1] = self.alive[i:self.size].copy()
+            self.vectors[i + 1:self.size + 1] = self.vectors[i:self.size].copy()
+        self.size += 1
+        self.ids[i] = movie_id
+        self.alive[i] = 1
+        self.vectors[i] = vector
+        self.max_id = max(self.max_id, movie_id)
+
+    def add(self, movie_id, year, genre, rating, description):
+        if not self.ready:
+            return
+        self._put(movie_id, self.vectorize(year, genre, rating, description))
+
+    def remove(self, movie_id):
+        i = self._row(movie_id)
+        if i is not None:
+            self.alive[i] = 0
+
+    def build(self, conn):
+        """Build a fresh index from the catalog on `conn` and swap it in."""
+        fresh = SimilarIndex()
+        fresh.fit(conn)
+        fresh._grow(max(conn.execute("SELECT count(*) FROM movies").fetchone()[0], 1024))
+        cursor = conn.execute("SELECT id, year, genre, rating, description FROM movies ORDER BY id")
+        while rows := cursor.fetchmany(BUILD_BATCH):
+            # Rows arrive in id order, so each batch is appended as a block
+            end = fresh.size + len(rows)
+            if end > fresh.capacity:
+                fresh._grow(max(end, fresh.capacity * 2))
+            fresh.ids[fresh.size:end] = [row[0] for row in rows]
+            fresh.alive[fresh.size:end] = 1
+            fresh.vectors[fresh.size:end] = fresh.vectorize_rows(rows)
+            fresh.size = end
+            fresh.max_id = rows[-1][0]
+        self._swap(fresh)
+
+    def _swap(self, other):
+        for name in ('size', 'capacity', 'ids', 'alive', 'vectors', 'genres', 'idf', 'max_id'):
+            setattr(self, name, getattr(other, name))
+        self.ready = True
+
+    def save(self, path=SIMILAR_INDEX_PATH):
+        vocabulary = json.dumps({'genres': self.genres, 'idf': self.idf}).encode()
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(_header.pack(MAGIC, DIMS, self.size, len(vocabulary), self.max_id))
+            f.write(vocabulary)
+            self.ids[:self.size].tofile(f)
+            self.alive[:self.size].tofile(f)
+            self.vectors[:self.size].tofile(f)
+        os.replace(tmp, path)
+
+    def read(self, path=SIMILAR_INDEX_PATH):
+        """Load a saved index. Returns False if it is missing or was built
+        with a different vector layout."""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return False
+        with f:
+            magic, dims, size, vocabulary_size, max_id = _header.unpack(f.read(_header.size))
+            if magic != MAGIC or dims != DIMS:
+                logger.warning(f"Ignoring similarity index {path} built with a different layout")
+                return False
+            vocabulary = json.loads(f.read(vocabulary_size))
+            fresh = SimilarIndex()
+            fresh.genres, fresh.idf, fresh.max_id = vocabulary['genres'], vocabulary['idf'], max_id
+            fresh.ids = np.fromfile(f, dtype='int64', count=size)
+            fresh.alive = np.fromfile(f, dtype='uint8', count=size)
+            fresh.vectors = np.fromfile(f, dtype='float32', count=size * DIMS).reshape(size, DIMS)
+            fresh.size = fresh.capacity = size
+        self._swap(fresh)
+        return True
+
+    async def load(self, database=db, path=SIMILAR_INDEX_PATH):
+        if not available():
+            logger.warning("NumPy is not installed; \"more like this\" recommendations are disabled")
+            return
+        started = time.monotonic()
+        if await asyncio.to_thread(self.read, path):
+            # Drop movies deleted since the index was saved
+            present = [row[0] for row in await database.fetchall("SELECT id FROM movies WHERE id <= ?", (self.max_id,))]
+            self.alive[:self.size] &= np.isin(self.ids[:self.size], present)
+            logger.info(f"Loaded similarity index of {self.size} movies in {time.monotonic() - started:.1f}s")
+        else:
+            logger.info("Building the similarity index; run `python main.py similar-index` to build it offline")
+            await database.read(self.build)
+            await asyncio.to_thread(self.save, path)
+            logger.info(f"Built similarity index of {self.size} movies in {time.monotonic() - started:.1f}s")
+        self._last_sync = time.monotonic()
+        await self.sync(database, force=True)
+
+    async def sync(self, database=db, force=False):
+        """Add movies inserted since the last scan (OMDB ingestion, imports)."""
+        if not self.ready or (not force and time.monotonic() - self._last_sync < SYNC_INTERVAL):
+            return
+        self._last_sync = time.monotonic()
+        rows = await database.fetchall(
+            "SELECT id, year, genre, rating, description FROM movies WHERE id > ? ORDER BY id", (self.max_id,)
+        )
+        if not rows:
+            return
+        vectors = await asyncio.to_thread(self.vectorize_rows, rows)
+        for row, vector in zip(rows, vectors):
+            self._put(row[0], vector)
+
+    # Queries
+
+    def similar(self, movie_id, limit=SIMILAR_COUNT):
+        """Ids of the `limit` movies most similar to `movie_id`, best first,
+        or None if the movie isn't indexed."""
+        i = self._row(movie_id)
+        if i is None:
+            return None
+        scores = self.vectors[:self.size] @ self.vectors[i]
+        scores[self.alive[:self.size] == 0] = -np.inf
+        scores[i] = -np.inf
+        k = min(limit, self.size - 1)
+        if k <= 0:
+            return []
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(-scores[top])]
+        return [int(self.ids[j]) for j in top if scores[j] > -np.inf]
+
+
+similar_index = SimilarIndex()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='main.py similar-index',
+                                     description='Build the "more like this" similarity index offline.')
+    parser.add_argument('--output', default=SIMILAR_INDEX_PATH, help='index file (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if not available():
+        parser.error("NumPy is required to build the similarity index (pip install numpy)")
+
+    started = time.monotonic()
+    index = SimilarIndex()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        index.build(conn)
+    finally:
+        conn.close()
+    index.save(args.output)
+    logger.info(f"Indexed {index.size} movies into {args.output} in {time.monotonic() - started:.1f}s")
@@ -0,0 +1,299 @@
+"""In-memory columnar snapshot of the catalog for filter-only searches.
+
+With SEARCH_ENGINE=memory, searches that filter only by genre, year and
+minimum rating are answered from compact columns held in memory instead of
+SQLite: ids, years and ratings are numeric arrays and genres are stored as
+a bitmask over a dictionary of genre words. Filters are evaluated in
+batches over chunks of rows, with NumPy if it is installed and plain
+`array` columns otherwise. Only the matching page of rows is then read
+from SQLite by primary key.
+
+Admin adds and deletes update the snapshot directly. A periodic catch-up
+scan picks up rows inserted by OMDB ingestion or imports, and rows whose
+OMDB details were filled in or refreshed since (by fetched_at). Rows an
+import updates in place are refreshed on the next restart.
+
+Searches run in a worker thread. A paginated search keeps the engine it
+started on, because snapshot results are in id order while SQLite ranks
+genre matches by bm25.
+"""
+import asyncio
+import bisect
+import logging
+import math
+import os
+import re
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from db import db
+
+logger = logging.getLogger(__name__)
+
+# 'sqlite' (default) or 'memory'
+SEARCH_ENGINE = os.environ.get('SEARCH_ENGINE', 'sqlite')
+
+# Rows filtered per batch; searches stop early once a page is full
+SCAN_CHUNK = 65536
+
+# Genre words beyond this many can't be encoded; queries using them go to SQLite
+GENRE_BITS = 64
+
+# Minimum seconds between catch-up scans for newly inserted movies
+SYNC_INTERVAL = 30
+
+# Catch-up batches with more rows than this are applied to a copy of the
+# snapshot in a worker thread instead of row by row on the event loop
+SYNC_INSERT_LIMIT = 64
+
+# Largest year the int16 column holds; bad years from OMDB or imports are
+# stored as unknown (0) instead
+MAX_YEAR = 32767
+
+# (array typecode, NumPy dtype) of each column
+COLUMNS = {
+    'ids': ('q', 'int64'),
+    'years': ('h', 'int16'),
+    'ratings': ('d', 'float64'),
+    'genres': ('Q', 'uint64'),
+    'alive': ('B', 'uint8'),
+}
+
+
+def _year(value):
+    try:
+        year = int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+    return year if 0 < year <= MAX_YEAR else 0
+
+
+def genre_words(text):
+    # Same words the FTS tokenizer sees in the genre column
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def _column(typecode, dtype, size):
+    if np is not None:
+        return np.zeros(size, dtype=dtype)
+    return array(typecode, bytes(array(typecode).itemsize * size))
+
+
+class CatalogSnapshot:
+    def __init__(self):
+        self.size = 0
+        self.capacity = 0
+        for name, (typecode, dtype) in COLUMNS.items():
+            setattr(self, name, _column(typecode, dtype, 0))
+        self.words = {}
+        self.unmapped = set()
+        self.max_id = 0
+        # Newest fetched_at seen, to find rows updated in place
+        self.fetched_at = 0.0
+        self.ready = False
+        self._last_sync = 0.0
+        # Bumped by every in-place change to the columns
+        self._version = 0
+
+    # Building and incremental updates
+
+    def _grow(self, capacity):
+        for name, (typecode, dtype) in COLUMNS.items():
+            column = _column(typecode, dtype, capacity)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def _genre_bits(self, genre):
+        bits = 0
+        for word in genre_words(genre):
+            bit = self.words.get(word)
+            if bit is None:
+                if len(self.words) >= GENRE_BITS:
+                    self.unmapped.add(word)
+                    continue
+                bit = self.words[word] = len(self.words)
+            bits |= 1 << bit
+        return bits
+
+    def _set(self, i, movie_id, year, genre, rating):
+        self.ids[i] = movie_id
+        self.years[i] = _year(year)
+        self.ratings[i] = rating if rating is not None else math.nan
+        self.genres[i] = self._genre_bits(genre)
+        self.alive[i] = 1
+
+    def build(self, rows):
+        """Build a fresh snapshot from (id, year, genre, rating) rows ordered
+        by id and swap it in."""
+        fresh = CatalogSnapshot()
+        fresh._grow(max(len(rows), 1024))
+        genre_cache = {}
+        for i, (movie_id, year, genre, rating) in enumerate(rows):
+            fresh.ids[i] = movie_id
+            fresh.years[i] = _year(year)
+            fresh.ratings[i] = rating if rating is not None else math.nan
+            bits = genre_cache.get(genre)
+            if bits is None:
+                bits = genre_cache[genre] = fresh._genre_bits(genre)
+            fresh.genres[i] = bits
+            fresh.alive[i] = 1
+        fresh.size = len(rows)
+        fresh.max_id = rows[-1][0] if rows else 0
+        self._swap(fresh)
+        self.ready = True
+
+    def _swap(self, fresh):
+        for name in (*COLUMNS, 'size', 'capacity', 'words', 'unmapped', 'max_id'):
+            setattr(self, name, getattr(fresh, name))
+
+    def _merged(self, rows):
+        """A copy of the snapshot with (id, year, genre, rating) rows added."""
+        fresh = CatalogSnapshot()
+        fresh._grow(max(self.size + len(rows), 1024))
+        for name in COLUMNS:
+            getattr(fresh, name)[:self.size] = getattr(self, name)[:self.size]
+        fresh.size, fresh.max_id = self.size, self.max_id
+        fresh.words, fresh.unmapped = dict(self.words), set(self.unmapped)
+        fresh.ready = True
+        for row in rows:
+            fresh.add(*row)
+        return fresh
+
+    def add(self, movie_id, year, genre, rating):
+        if not self.ready:
+            return
+        i = bisect.bisect_left(self.ids, movie_id, 0, self.size)
+        if i < self.size and self.ids[i] == movie_id:
+            self._set(i, movie_id, year, genre, rating)
+            self._version += 1
+            return
+        if self.size == self.capacity:
+            self._grow(self.capacity * 2)
+        if i < self.size:
+            # Reused id below the maximum: shift the tail up by one row
+            for name in COLUMNS:
+                column = getattr(self, name)
+                column[i + 1:self.size + 1] = column[i:self.size].copy() if np is not None else column[i:self.size]
+        self.size += 1
+        self._set(i, movie_id, year, genre, rating)
+        self.max_id = max(self.max_id, movie_id)
+        self._version += 1
+
+    def remove(self, movie_id):
+        i = bisect.bisect_left(self.ids, movie_id, 0, self.size)
+        if i < self.size and self.ids[i] == movie_id:
+            self.alive[i] = 0
+            self._version += 1
+
+    async def load(self, database=db):
+        started = time.monotonic()
+        # Read before the rows, so updates made during the load are caught up
+        fetched_at = (await database.fetchone("SELECT max(fetched_at) FROM movies"))[0] or 0.0
+        rows = await database.fetchall("SELECT id, year, genre, rating FROM movies ORDER BY id")
+        await asyncio.to_thread(self.build, rows)
+        self.fetched_at = fetched_at
+        self._last_sync = time.monotonic()
+        backend = 'NumPy' if np is not None else 'array'
+        logger.info(f"Loaded {self.size} movies into the {backend} search snapshot in {time.monotonic() - started:.1f}s")
+        await self.sync(database, force=True)
+
+    async def sync(self, database=db, force=False):
+        """Add movies inserted since the last scan (OMDB ingestion, imports)
+        and refresh movies whose OMDB data was fetched since."""
+        if not self.ready or (not force and time.monotonic() - self._last_sync < SYNC_INTERVAL):
+            return
+        self._last_sync = time.monotonic()
+        # >= so rows stamped in the same instant as the last scan aren't missed;
+        # adding a row again just overwrites it
+        rows = await database.fetchall("""
+            SELECT id, year, genre, rating, fetched_at FROM movies WHERE id > ?
+            UNION
+            SELECT id, year, genre, rating, fetched_at FROM movies WHERE fetched_at >= ?
+            ORDER BY id
+        """, (self.max_id, self.fetched_at))
+        if len(rows) <= SYNC_INSERT_LIMIT:
+            for movie_id, year, genre, rating, _ in rows:
+                self.add(movie_id, year, genre, rating)
+        else:
+            # Apply the batch to a copy off the event loop; start over if
+            # add() or remove() changed the snapshot in the meantime
+            batch = [row[:4] for row in rows]
+            while True:
+                version = self._version
+                fresh = await asyncio.to_thread(self._merged, batch)
+                if version == self._version:
+                    break
+            self._swap(fresh)
+        for *_, fetched_at in rows:
+            if fetched_at is not None:
+                self.fetched_at = max(self.fetched_at, fetched_at)
+
+    # Queries
+
+    def _genre_masks(self, genre):
+        """One bitmask per genre word (a row must match each), or None if a
+        word may match genre words the snapshot couldn't encode."""
+        masks = []
+        for word in genre_words(genre):
+            if any(unmapped.startswith(word) for unmapped in self.unmapped):
+                return None
+            mask = 0
+            for name, bit in self.words.items():
+                if name.startswith(word):
+                    mask |= 1 << bit
+            masks.append(mask)
+        return masks
+
+    def can_answer(self, title=None, genre=None, actor=None, director=None):
+        return self.ready and not (title or actor or director) and self._genre_masks(genre) is not None
+
+    def _chunk_matches(self, lo, hi, masks, year, min_rating):
+        """Offsets (relative to lo) of matching rows in [lo, hi)."""
+        if year and not 0 < year <= MAX_YEAR:
+            return []
+        if np is not None:
+            match = self.alive[lo:hi].astype(bool)
+            if year:
+                match &= self.years[lo:hi] == year
+            if min_rating:
+                match &= self.ratings[lo:hi] >= min_rating
+            for mask in masks:
+                match &= (self.genres[lo:hi] & np.uint64(mask)) != 0
+            return np.flatnonzero(match)
+        return [i - lo for i in range(lo, hi)
+                if self.alive[i]
+                and (not year or self.years[i] == year)
+                and (not min_rating or self.ratings[i] >= min_rating)
+                and all(self.genres[i] & mask for mask in masks)]
+
+    def search(self, genre=None, year=None, min_rating=None, after_id=0, limit=10):
+        """Ids of matching movies above `after_id`, in id order."""
+        masks = self._genre_masks(genre)
+        start = bisect.bisect_right(self.ids, after_id, 0, self.size)
+        found = []
+        for lo in range(start, self.size, SCAN_CHUNK):
+            hi = min(lo + SCAN_CHUNK, self.size)
+            for offset in self._chunk_matches(lo, hi, masks, year, min_rating)[:limit - len(found)]:
+                found.append(int(self.ids[lo + offset]))
+            if len(found) >= limit:
+                break
+        return found
+
+    def count(self, genre=None, year=None, min_rating=None, limit=None):
+        """Number of matching movies, counting stops once it exceeds `limit`."""
+        masks = self._genre_masks(genre)
+        total = 0
+        for lo in range(0, self.size, SCAN_CHUNK):
+            total += len(self._chunk_matches(lo, min(lo + SCAN_CHUNK, self.size), masks, year, min_rating))
+            if limit is not None and total > limit:
+                break
+        return total
+
+
+catalog_snapshot = CatalogSnapshot()
@@ -0,0 +1,164 @@
+import asyncio
+import difflib
+import logging
+import re
+import time
+from array import array
+from collections import Counter
+
+from db import db
+
+logger = logging.getLogger(__name__)
+
+# Candidates below this similarity (0-1) are not suggested
+MIN_SIMILARITY = 0.6
+
+# Trigram matches re-ranked with a full edit-distance comparison
+RERANK_CANDIDATES = 50
+
+# Trigrams shared by more than this fraction of titles carry little signal
+# and are skipped when the query has rarer ones
+COMMON_TRIGRAM_RATIO = 0.05
+
+# Minimum seconds between catch-up scans for newly inserted movies
+SYNC_INTERVAL = 30
+
+# Rebuild from memory once this fraction of postings points at removed or
+# re-added titles
+STALE_RATIO = 0.2
+
+# Catch-up batches with more rows than this are indexed in a worker thread
+# instead of added one by one on the event loop
+SYNC_INSERT_LIMIT = 64
+
+
+def normalize(title):
+    return ' '.join(re.findall(r'\w+', title.lower()))
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """In-memory trigram index over catalog titles for "did you mean" lookups.
+
+    Each trigram maps to a compact array of movie ids. New movies are added
+    incrementally (explicitly or by a catch-up scan of ids above the highest
+    one indexed) and deleted movies are dropped from the title map, so their
+    stale postings are ignored until the next full rebuild.
+    """
+
+    def __init__(self):
+        self.titles = {}
+        self.postings = {}
+        self.max_id = 0
+        self.ready = False
+        self._last_sync = 0.0
+        self._stale_postings = 0
+
+    def add(self, movie_id, title):
+        text = normalize(title or '')
+        if not text:
+            return
+        if movie_id in self.titles:
+            self._stale_postings += 1
+        self.titles[movie_id] = (title, text)
+        for gram in trigrams(text):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array('l')
+            postings.append(movie_id)
+        self.max_id = max(self.max_id, movie_id)
+
+    def remove(self, movie_id):
+        if self.titles.pop(movie_id, None) is not None:
+            self._stale_postings += 1
+
+    def build(self, rows):
+        """Build a fresh index from (id, title) rows and swap it in."""
+        fresh = TitleIndex()
+        for movie_id, title in rows:
+            fresh.add(movie_id, title)
+        self.titles, self.postings, self.max_id = fresh.titles, fresh.postings, fresh.max_id
+        self._stale_postings = 0
+        self.ready = True
+
+    def merge(self, other):
+        """Add the titles and postings of an index over new movies."""
+        self.titles.update(other.titles)
+        for gram, ids in other.postings.items():
+            postings = self.postings.get(gram)
+            if postings is None:
+                self.postings[gram] = ids
+            else:
+                postings.extend(ids)
+        self.max_id = max(self.max_id, other.max_id)
+
+    def suggest(self, query, limit=3):
+        """Return up to `limit` (movie_id, title, similarity) candidates."""
+        text = normalize(query or '')
+        if not text or not self.titles:
+            return []
+
+        grams = trigrams(text)
+        common = len(self.titles) * COMMON_TRIGRAM_RATIO
+        lists = [self.postings[g] for g in grams if g in self.postings]
+        rare = [postings for postings in lists if len(postings) <= common]
+        counts = Counter()
+        for postings in (rare or lists):
+            counts.update(postings)
+
+        scored = []
+        for movie_id, shared in counts.most_common(RERANK_CANDIDATES * 4):
+            entry = self.titles.get(movie_id)
+            if entry is None:
+                continue
+            title, candidate = entry
+            overlap = shared / len(grams | trigrams(candidate))
+            similarity = max(overlap, difflib.SequenceMatcher(None, text, candidate).ratio())
+            scored.append((similarity, movie_id, title))
+            if len(scored) >= RERANK_CANDIDATES:
+                break
+
+        scored.sort(reverse=True)
+        return [(movie_id, title, round(similarity, 3)) for similarity, movie_id, title in scored[:limit]
+                if similarity >= MIN_SIMILARITY]
+
+    async def load(self, database=db):
+        started = time.monotonic()
+        rows = await database.fetchall("SELECT id, title FROM movies")
+        await asyncio.to_thread(self.build, rows)
+        self._last_sync = time.monotonic()
+        logger.info(f"Indexed {len(self.titles)} titles for suggestions in {time.monotonic() - started:.1f}s")
+        # Pick up anything inserted while the index was being built
+        await self.sync(database, force=True)
+
+    async def sync(self, database=db, force=False):
+        """Index movies inserted since the last scan (OMDB ingestion, imports)."""
+        if not self.ready or (not force and time.monotonic() - self._last_sync < SYNC_INTERVAL):
+            return
+        self._last_sync = time.monotonic()
+        rows = await database.fetchall("SELECT id, title FROM movies WHERE id > ? ORDER BY id", (self.max_id,))
+        if len(rows) <= SYNC_INSERT_LIMIT:
+            for movie_id, title in rows:
+                self.add(movie_id, title)
+        else:
+            # Index the batch off the event loop; leave out anything add()
+            # indexed in the meantime so no title gets duplicate postings
+            while True:
+                fresh = TitleIndex()
+                await asyncio.to_thread(fresh.build, rows)
+                if not fresh.titles.keys() & self.titles.keys():
+                    break
+                rows = [row for row in rows if row[0] not in self.titles]
+            self.merge(fresh)
+            self.max_id = max(self.max_id, rows[-1][0] if rows else 0)
+
+        if self._stale_postings > len(self.titles) * STALE_RATIO + 1000:
+            rows = [(movie_id, title) for movie_id, (title, _) in self.titles.items()]
+            await asyncio.to_thread(self.build, rows)
+
+
+title_index = TitleIndex()
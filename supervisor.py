@@ -0,0 +1,220 @@
+"""Run several bot worker processes behind one webhook port.
+
+The supervisor owns the webhook: it receives Telegram's POSTs, picks a
+worker from the id of the user who sent the update (or the chat id when
+there is no user) and forwards the update over that worker's Unix socket.
+A user always lands on the same worker, over a single ordered stream, so
+their user_data has a single owner and conversations see their updates in
+order. Workers run the normal Application without an Updater and keep
+conversation state in the shared persistence backend. Bot-wide limits (the
+OMDB daily quota and the global send rate) are split evenly between them.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+import struct
+import sys
+import tempfile
+
+from telegram import Bot, Update
+
+from gateway import OMDB_DAILY_QUOTA
+from sender import SEND_GLOBAL_BURST, SEND_GLOBAL_RATE
+
+logger = logging.getLogger(__name__)
+
+# Worker processes started in webhook mode; 1 keeps the single-process setup
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 1))
+WORKER_SOCKET_DIR = os.environ.get('WORKER_SOCKET_DIR', tempfile.gettempdir())
+
+# Sent by Telegram in X-Telegram-Bot-Api-Secret-Token when set
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+
+# Seconds to wait before restarting a worker that exited
+RESTART_DELAY = 1.0
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+_frame = struct.Struct('>I')
+
+
+def routing_key(data):
+    """User id of an update (chat id if it has no user, e.g. channel posts)."""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get('from')
+        if user:
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return data.get('update_id', 0)
+
+
+class Supervisor:
+    def __init__(self, token, webhook_url, port, workers=WEB_WORKERS):
+        self.token = token
+        self.webhook_url = webhook_url
+        self.port = port
+        self.workers = workers
+        self.processes = [None] * workers
+        self.streams = [None] * workers
+        self._stopping = False
+
+    def socket_path(self, index):
+        return os.path.join(WORKER_SOCKET_DIR, f"kino-bot-{os.getpid()}-{index}.sock")
+
+    async def _spawn(self, index):
+        path = self.socket_path(index)
+        if os.path.exists(path):
+            os.unlink(path)
+        env = dict(os.environ)
+        metrics_port = int(env.get('METRICS_PORT', 9091))
+        env['METRICS_PORT'] = str(metrics_port + index if metrics_port else 0)
+        # Each worker gets an equal share of the limits that apply to the bot
+        # as a whole
+        env['OMDB_DAILY_QUOTA'] = str(max(1, OMDB_DAILY_QUOTA // self.workers))
+        env['SEND_GLOBAL_RATE'] = str(SEND_GLOBAL_RATE / self.workers)
+        env['SEND_GLOBAL_BURST'] = str(max(1, SEND_GLOBAL_BURST // self.workers))
+        self.processes[index] = await asyncio.create_subprocess_exec(
+            sys.executable, MAIN, 'worker', path, env=env
+        )
+        # Wait for the worker to start listening
+        for _ in range(600):
+            if self.processes[index].returncode is not None:
+                return
+            try:
+                _, self.streams[index] = await asyncio.open_unix_connection(path)
+                logger.info(f"Worker {index} started (pid {self.processes[index].pid})")
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+        logger.error(f"Worker {index} did not start listening on {path}")
+
+    async def _watch(self, index):
+        while not self._stopping:
+            await self.processes[index].wait()
+            self.streams[index] = None
+            if self._stopping:
+                return
+            logger.error(f"Worker {index} exited with {self.processes[index].returncode}, restarting")
+            await asyncio.sleep(RESTART_DELAY)
+            await self._spawn(index)
+
+    async def forward(self, body):
+        data = json.loads(body)
+        index = routing_key(data) % self.workers
+        stream = self.streams[index]
+        if stream is None:
+            return False
+        stream.write(_frame.pack(len(body)) + body)
+        await stream.drain()
+        return True
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                secret = headers.get('x-telegram-bot-api-secret-token', '')
+                if method != 'POST' or path != f"/{self.token}":
+                    status = '404 Not Found'
+                elif WEBHOOK_SECRET and not hmac.compare_digest(secret, WEBHOOK_SECRET):
+                    status = '403 Forbidden'
+                else:
+                    try:
+                        # Telegram retries the update later if its worker is restarting
+                        status = '200 OK' if await self.forward(body) else '503 Service Unavailable'
+                    except (ValueError, ConnectionError) as e:
+                        logger.warning(f"Could not forward update: {e}")
+                        status = '503 Service Unavailable' if isinstance(e, ConnectionError) else '400 Bad Request'
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        for index in range(self.workers):
+            await self._spawn(index)
+        watchers = [loop.create_task(self._watch(index)) for index in range(self.workers)]
+
+        server = await asyncio.start_server(self._handle, '0.0.0.0', self.port)
+        async with Bot(self.token) as bot:
+            await bot.set_webhook(f"{self.webhook_url}/{self.token}", secret_token=WEBHOOK_SECRET or None)
+        logger.info(f"Bot started with webhook and {self.workers} workers")
+
+        await stop.wait()
+        self._stopping = True
+        server.close()
+        for process in self.processes:
+            if process is not None and process.returncode is None:
+                process.terminate()
+        await asyncio.gather(*(process.wait() for process in self.processes if process is not None))
+        for watcher in watchers:
+            watcher.cancel()
+        for index in range(self.workers):
+            if os.path.exists(self.socket_path(index)):
+                os.unlink(self.socket_path(index))
+
+
+def run_supervisor(token, webhook_url, port, workers=WEB_WORKERS):
+    asyncio.run(Supervisor(token, webhook_url, port, workers).run())
+
+
+async def _serve_worker(application, socket_path):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def receive(reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(_frame.size)
+                body = await reader.readexactly(_frame.unpack(header)[0])
+                update = Update.de_json(json.loads(body), application.bot)
+                await application.update_queue.put(update)
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    server = await asyncio.start_unix_server(receive, socket_path)
+
+    await stop.wait()
+    server.close()
+    await application.stop()
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+def run_worker(application, socket_path):
+    """Serve updates forwarded by the supervisor until terminated."""
+    asyncio.run(_serve_worker(application, socket_path))
@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from updates import ChatOrderedUpdateProcessor
+
+
+def message_from(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=None)
+
+
+class ChatOrderTest(unittest.IsolatedAsyncioTestCase):
+    async def dispatch(self, processor, update, coroutine):
+        # What BackpressureQueue.get() and Application do for each update
+        await processor.pending.acquire()
+        return asyncio.create_task(processor.process_update(update, coroutine))
+
+    async def test_updates_from_one_chat_run_in_order(self):
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=4, max_pending=64)
+        seen = {1: [], 2: []}
+
+        async def handle(chat_id, n, delay):
+            await asyncio.sleep(delay)
+            seen[chat_id].append(n)
+
+        tasks = []
+        for n in range(10):
+            # Earlier updates take longer, so running them in parallel would reorder them
+            tasks.append(await self.dispatch(processor, message_from(1), handle(1, n, (10 - n) / 1000)))
+            tasks.append(await self.dispatch(processor, message_from(2), handle(2, n, (10 - n) / 1000)))
+        await asyncio.gather(*tasks)
+
+        self.assertEqual(seen, {1: list(range(10)), 2: list(range(10))})
+        self.assertEqual(processor._chats, {})
+
+    async def test_backlogged_chat_does_not_block_other_chats(self):
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2, max_pending=64)
+        release = asyncio.Event()
+        done = []
+
+        async def blocked():
+            await release.wait()
+
+        async def quick():
+            done.append('other chat')
+
+        backlog = [await self.dispatch(processor, message_from(1), blocked()) for _ in range(5)]
+        other = await self.dispatch(processor, message_from(2), quick())
+        await asyncio.wait_for(other, 1)
+
+        self.assertEqual(done, ['other chat'])
+        self.assertEqual(processor.in_flight, 1)
+        if hasattr(processor, 'current_concurrent_updates'):  # PTB 21.11+
+            self.assertEqual(processor.current_concurrent_updates, 5)
+
+        release.set()
+        await asyncio.gather(*backlog)
+        self.assertEqual(processor.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
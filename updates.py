@@ -0,0 +1,126 @@
+"""Concurrent update processing that keeps each chat's updates in order.
+
+Updates from different chats run in parallel, up to UPDATE_CONCURRENCY at a
+time, while updates from one chat run strictly one after another, so the
+/search conversation and /addmovie never see their messages out of order.
+The update queue is bounded and stops handing out updates while too many
+are pending, which in turn pauses polling (or the webhook) instead of
+buffering an unbounded backlog in memory.
+
+The processor only implements PTB's do_process_update() hook. Its
+max_concurrent_updates is the pending limit, so current_concurrent_updates
+counts every update taken off the queue; UPDATE_CONCURRENCY caps how many
+of them run handlers at once.
+"""
+import asyncio
+import logging
+import os
+
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# Updates processed at the same time (across different chats)
+UPDATE_CONCURRENCY = int(os.environ.get('UPDATE_CONCURRENCY', 32))
+
+# Updates taken off the queue but not finished yet, including ones waiting
+# for an earlier update from the same chat
+UPDATE_PENDING_LIMIT = int(os.environ.get('UPDATE_PENDING_LIMIT', 256))
+
+# Updates received but not yet taken off the queue
+UPDATE_QUEUE_SIZE = int(os.environ.get('UPDATE_QUEUE_SIZE', 1000))
+
+
+def chat_key(update):
+    """The chat an update belongs to, or its user for chat-less updates
+    such as inline queries. None if it has neither."""
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, 'effective_user', None)
+    return user.id if user is not None else None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=UPDATE_CONCURRENCY, max_pending=UPDATE_PENDING_LIMIT):
+        # The base class semaphore admits every pending update; the queue
+        # already keeps them within max_pending
+        super().__init__(max(max_pending, max_concurrent_updates))
+        self.pending = asyncio.Semaphore(max_pending)
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # chat key -> [lock, number of updates holding or waiting for it]
+        self._chats = {}
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            key = chat_key(update)
+            if key is None:
+                async with self._slots:
+                    await self._run(coroutine)
+                return
+
+            # Take the chat's turn before a handler slot, so a chat with a
+            # backlog cannot hold slots that other chats could use
+            entry = self._chats.get(key)
+            if entry is None:
+                entry = self._chats[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            try:
+                async with entry[0], self._slots:
+                    await self._run(coroutine)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._chats[key]
+        finally:
+            self.pending.release()
+
+    async def _run(self, coroutine):
+        self.in_flight += 1
+        try:
+            await coroutine
+        finally:
+            self.in_flight -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class BackpressureQueue(asyncio.Queue):
+    """Update queue that only hands out an update once the processor has
+    room for another pending one. Being bounded, put() waits when it is
+    full, which holds back the Updater or the webhook."""
+
+    def __init__(self, processor, maxsize=UPDATE_QUEUE_SIZE):
+        super().__init__(maxsize)
+        self.processor = processor
+        self._warned = False
+
+    async def get(self):
+        if self.full() and not self._warned:
+            self._warned = True
+            logger.warning(f"Update queue is full ({self.maxsize} updates), delaying new updates")
+        elif self.empty():
+            self._warned = False
+        await self.processor.pending.acquire()
+        try:
+            return await super().get()
+        except BaseException:
+            self.processor.pending.release()
+            raise
+
+
+def create_update_handling():
+    """Return (processor, queue) for ApplicationBuilder.concurrent_updates()
+    and .update_queue()."""
+    processor = ChatOrderedUpdateProcessor()
+    queue = BackpressureQueue(processor)
+    Gauge('bot_update_queue_depth', 'Updates received but not yet processed.', queue.qsize)
+    Gauge('bot_updates_in_flight', 'Updates being processed.', lambda: processor.in_flight)
+    return processor, queue